@@ -1,13 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+
 from langchain_core.messages import SystemMessage, HumanMessage
-from langgraph.constants import END
+from langchain_core.runnables import RunnableConfig
+from langgraph.constants import START, END
 from langgraph.graph import StateGraph
+from langgraph.types import Send
+from pydantic import BaseModel, Field
+import asyncio
+import logging
 import time
 
-from llm_service import LLMService, llm_cache, CACHE_EXPIRY
-from typing import Dict, Any, List, TypedDict
+from llm_service import (
+    AnalysisResult, LLMService, extract_json, get_cached_result, on_event_loop, run_coroutine, set_cached_result,
+)
+from setting import settings
+from typing import Dict, Any, List, Tuple, TypedDict
+
+log = logging.getLogger(__name__)
+
+
+# 各角色的静态指令放在SystemMessage中，每次调用内容完全一致，便于服务端前缀缓存命中；
+# HumanMessage中只放动态的股票数据和上游分析结果
+FUNDAMENTAL_SYSTEM_PROMPT = """你是一个专业的股票基本面分析师，擅长财务分析和估值评估。
+
+请基于用户提供的股票基本信息进行深入的基本面分析，请分析：
+1. 公司财务状况和盈利能力
+2. 行业地位和竞争优势
+3. 估值水平是否合理
+4. 长期投资价值
+
+请给出详细的基本面分析报告。"""
+
+TECHNICAL_SYSTEM_PROMPT = """你是一个专业的股票技术分析师，擅长技术指标分析和趋势判断。
+
+请基于用户提供的实时数据和历史数据进行技术分析，请分析：
+1. 价格趋势和支撑阻力位
+2. 成交量变化和资金流向
+3. 技术指标信号（如MACD、RSI、均线等）
+4. 短期交易机会
+
+请给出详细的技术分析报告。"""
+
+TRADER_SYSTEM_PROMPT = """你是一个经验丰富的股市交易员，擅长风险管理和交易策略制定。
+
+请基于用户提供的基本面分析和技术分析，给出具体的交易建议，请综合考虑：
+1. 风险收益比
+2. 市场情绪和资金面
+3. 交易时机和仓位管理
+4. 止损止盈策略
+
+请给出具体的交易建议。"""
 
+FINAL_DECISION_SYSTEM_PROMPT = """你是首席投资官，需要综合各方分析做出最终投资决策。
 
-class MessageState(TypedDict):
+请基于用户提供的三位专家的分析，给出最终的T+1选股建议，包括：
+- 建议（买入/卖出/保持）
+- 推荐原因
+- 动作（买/卖/保持）
+- 预测价格（T+1）
+- 预测买入价格（T+1）
+- 预测卖出价格（T+1）
+- 预测信心（0-1）
+
+请以JSON格式返回结果。"""
+
+# 合并模式：一次请求依次完成三位专家的分析和最终决策，共享同一份股票数据的前缀
+FUSED_SYSTEM_PROMPT = """你需要依次扮演四个角色，基于用户提供的股票基本信息、实时数据和历史数据完成T+1选股分析。
+
+1. 基本面分析师：分析公司财务状况和盈利能力、行业地位和竞争优势、估值水平是否合理、长期投资价值
+2. 技术分析师：分析价格趋势和支撑阻力位、成交量变化和资金流向、技术指标信号（如MACD、RSI、均线等）、短期交易机会
+3. 交易员：基于基本面分析和技术分析，综合考虑风险收益比、市场情绪和资金面、交易时机和仓位管理、止损止盈策略，给出具体的交易建议
+4. 首席投资官：综合三位专家的分析，给出最终的T+1选股建议，包括：
+- recommendation: 买入/卖出/保持
+- reason: 推荐原因
+- action: 买/卖/保持
+- predicted_price: T+1预测价格
+- predicted_buy_price: T+1预测买入价
+- predicted_sell_price: T+1预测卖出价
+- confidence: 0-1的信心值
+
+请严格以JSON格式返回 {"fundamental_analysis": "...", "technical_analysis": "...", "trader_analysis": "...", "final_recommendation": {...}}，不要添加其他内容。"""
+
+
+class FusedAnalysisResult(BaseModel):
+    """合并模式的分析结果，各角色的分析在最终决策之前生成，最终决策可以参考前面的分析
+
+    final_recommendation为必填：响应缺少最终决策时校验失败，走单次分析回退，不会把默认的"保持"当作决策缓存下来。
+    """
+    fundamental_analysis: str = Field('', description='基本面分析')
+    technical_analysis: str = Field('', description='技术分析')
+    trader_analysis: str = Field('', description='交易建议')
+    final_recommendation: AnalysisResult = Field(description='最终T+1选股建议')
+
+
+class MessageState(TypedDict, total=False):
     """状态对象"""
     stock_data: Dict[str, Any]
     history_data: List[Dict[str, Any]]
@@ -15,37 +102,58 @@ class MessageState(TypedDict):
     fundamental_analyst: str
     technical_analysis: str
     trader_analysis: str
-    final_recommendation: str
+    final_recommendation: Dict[str, Any]
+
+
 
+# 多角色分析失败时退回同步的单次分析，放到共享线程池中执行，避免阻塞事件循环并使多只股票的回退请求并发进行
+_FALLBACK_POOL = ThreadPoolExecutor(max_workers=settings.llm_concurrency, thread_name_prefix="llm-fallback")
 
 
 class MultiRoleAnalyzer:
     def __init__(self):
         self.llm_service = LLMService()
-        self.graph = self._build_graph()
-    def _build_graph(self):
+        self.graph = self._compiled_graph()
+        self.structured_fused_llm = self.llm_service.llm.with_structured_output(FusedAnalysisResult)
+
+    @classmethod
+    @lru_cache(maxsize=1)
+    def _compiled_graph(cls):
+        """编译后的图在类级别只构建一次，所有实例共享；节点通过config获取各实例的llm_service"""
+        return cls._build_graph()
+
+    @classmethod
+    def _build_graph(cls):
 
         workflow = StateGraph(MessageState)
 
-        workflow.add_node("fundamental_analyst", self.fundamental_analysis_node)
-        workflow.add_node("technical_analyst", self.technical_analysis_node)
-        workflow.add_node("trader_analyst", self.trader_analysis_node)
-        workflow.add_node("final_decision", self.final_decision_node)
+        workflow.add_node("fundamental_analyst", cls.fundamental_analysis_node)
+        workflow.add_node("technical_analyst", cls.technical_analysis_node)
+        workflow.add_node("trader_analyst", cls.trader_analysis_node)
+        workflow.add_node("final_decision", cls.final_decision_node)
 
-        workflow.set_entry_point("fundamental_analyst")
-        workflow.add_edge("fundamental_analyst", "technical_analyst")
-        workflow.add_edge("technical_analyst", "trader_analyst")
+        # 基本面分析与技术分析互不依赖，由dispatch并行分发；交易员等待两者都完成后再执行
+        workflow.add_conditional_edges(START, cls.dispatch, ["fundamental_analyst", "technical_analyst"])
+        workflow.add_edge(["fundamental_analyst", "technical_analyst"], "trader_analyst")
         workflow.add_edge("trader_analyst", "final_decision")
         workflow.add_edge("final_decision", END)
 
         return workflow.compile()
 
-    def fundamental_analysis_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """基本面分析师节点"""
-        prompt = f"""
-作为基本面分析师，请对以下股票进行深入的基本面分析：
+    @staticmethod
+    def _llm_service(config: RunnableConfig) -> LLMService:
+        """从运行配置中取出调用方实例的llm_service"""
+        return config["configurable"]["llm_service"]
 
-股票基本信息：
+    @staticmethod
+    def dispatch(state: Dict[str, Any]) -> List[Send]:
+        """分发节点：并行启动基本面分析师和技术分析师"""
+        return [Send("fundamental_analyst", state), Send("technical_analyst", state)]
+
+    @staticmethod
+    def _fundamental_prompt(state: Dict[str, Any]) -> str:
+        """基本面分析使用的股票基本信息"""
+        return f"""股票基本信息：
 - 代码: {state['stock_data'].get('code', '')}
 - 名称: {state['stock_data'].get('name', '')}
 - 行业: {state['stock_info'].get('sector', '') if state['stock_info'] else '未知'}
@@ -53,38 +161,14 @@ class MultiRoleAnalyzer:
 - 流通市值: {state['stock_data'].get('circulating_market_value', 0)}万元
 - 市盈率: {state['stock_data'].get('pe_ratio', 0)}
 - 市净率: {state['stock_data'].get('pb_ratio', 0)}
-
-请分析：
-1. 公司财务状况和盈利能力
-2. 行业地位和竞争优势
-3. 估值水平是否合理
-4. 长期投资价值
-
-请给出详细的基本面分析报告。
 """
 
-        response = self.llm_service.llm.invoke([
-            SystemMessage(content="你是一个专业的股票基本面分析师，擅长财务分析和估值评估。"),
-            HumanMessage(content=prompt)
-        ])
-        state['fundamental_analyst'] = response.content
-        # 只打印关键信息，减少输出开销
-        # print(f"基本面分析师: {response.content}")
-        return state
-
-    def technical_analysis_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """技术指标分析师节点"""
+    @staticmethod
+    def _technical_prompt(state: Dict[str, Any], llm_service: LLMService) -> str:
+        """技术分析使用的实时数据和最近15天K线"""
+        history_summary = llm_service._format_history(state['history_data'], 15, ohlc=True)
 
-        history_summary = "\n".join([
-            f"日期: {d['date']}, 开盘: {d['open']}, 最高: {d['high']}, 最低: {d['low']}, 收盘: {d['close']}, "
-            f"成交量: {d['volume']}, 涨跌幅: {d['pctChg']}%"
-            for d in state['history_data'][:15]
-        ])
-
-        prompt = f"""
-作为技术指标分析师，请对以下股票进行技术分析：
-
-实时数据：
+        return f"""实时数据：
 - 当前价格: {state['stock_data'].get('current_price', 0)}
 - 涨跌幅: {state['stock_data'].get('change_percent', 0)}%
 - 开盘价: {state['stock_data'].get('open', 0)}
@@ -94,62 +178,59 @@ class MultiRoleAnalyzer:
 
 历史数据（最近15天）：
 {history_summary}
+"""
 
-请分析：
-1. 价格趋势和支撑阻力位
-2. 成交量变化和资金流向
-3. 技术指标信号（如MACD、RSI、均线等）
-4. 短期交易机会
+    @staticmethod
+    async def fundamental_analysis_node(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+        """基本面分析师节点"""
+        prompt = MultiRoleAnalyzer._fundamental_prompt(state)
 
-请给出详细的技术分析报告。
-"""
+        response = await MultiRoleAnalyzer._llm_service(config).llm.ainvoke([
+            SystemMessage(content=FUNDAMENTAL_SYSTEM_PROMPT),
+            HumanMessage(content=prompt)
+        ])
+        # 只打印关键信息，减少输出开销
+        # print(f"基本面分析师: {response.content}")
+        # 只返回本节点写入的字段，避免与并行的技术分析节点产生状态更新冲突
+        return {'fundamental_analyst': response.content}
+
+    @staticmethod
+    async def technical_analysis_node(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+        """技术指标分析师节点"""
+        prompt = MultiRoleAnalyzer._technical_prompt(state, MultiRoleAnalyzer._llm_service(config))
 
-        response = self.llm_service.llm.invoke([
-            SystemMessage(content="你是一个专业的股票技术分析师，擅长技术指标分析和趋势判断。"),
+        response = await MultiRoleAnalyzer._llm_service(config).llm.ainvoke([
+            SystemMessage(content=TECHNICAL_SYSTEM_PROMPT),
             HumanMessage(content=prompt)
         ])
-        state['technical_analysis'] = response.content
         # 只打印关键信息，减少输出开销
         # print(f"技术分析师: {response.content}")
-        return state
+        return {'technical_analysis': response.content}
 
-    def trader_analysis_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    @staticmethod
+    async def trader_analysis_node(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
         """交易员分析节点"""
 
-        prompt = f"""
-作为股市交易员，请基于基本面分析和技术分析，给出具体的交易建议：
-
-基本面分析：
+        prompt = f"""基本面分析：
 {state['fundamental_analyst']}
 
 技术分析：
 {state['technical_analysis']}
-
-请综合考虑：
-1. 风险收益比
-2. 市场情绪和资金面
-3. 交易时机和仓位管理
-4. 止损止盈策略
-
-请给出具体的交易建议。
 """
 
-        response = self.llm_service.llm.invoke([
-            SystemMessage(content="你是一个经验丰富的股市交易员，擅长风险管理和交易策略制定。"),
+        response = await MultiRoleAnalyzer._llm_service(config).llm.ainvoke([
+            SystemMessage(content=TRADER_SYSTEM_PROMPT),
             HumanMessage(content=prompt)
         ])
-        state['trader_analysis'] = response.content
         # 只打印关键信息，减少输出开销
         # print(f"交易员分析师: {response.content}")
-        return state
+        return {'trader_analysis': response.content}
 
-    def final_decision_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    @staticmethod
+    async def final_decision_node(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
         """最终决策节点"""
 
-        prompt = f"""
-请基于三位专家的分析，给出最终的T+1选股建议：
-
-基本面分析：
+        prompt = f"""基本面分析：
 {state['fundamental_analyst']}
 
 技术分析：
@@ -157,61 +238,110 @@ class MultiRoleAnalyzer:
 
 交易员分析：
 {state['trader_analysis']}
-
-请给出具体的投资建议，包括：
-- 建议（买入/卖出/保持）
-- 推荐原因
-- 动作（买/卖/保持）
-- 预测价格（T+1）
-- 预测买入价格（T+1）
-- 预测卖出价格（T+1）
-- 预测信心（0-1）
-
-请以JSON格式返回结果。
 """
 
-        response = self.llm_service.llm.invoke([
-            SystemMessage(content="你是首席投资官，需要综合各方分析做出最终投资决策。"),
+        final_result = await MultiRoleAnalyzer._llm_service(config).ainvoke_analysis([
+            SystemMessage(content=FINAL_DECISION_SYSTEM_PROMPT),
             HumanMessage(content=prompt)
         ])
         # 只打印关键信息，减少输出开销
-        # print(f"大模型最终决策结果: {response.content}")
-        final_result = self.llm_service._parse_response(response.content)
-        state['final_recommendation'] = final_result
-        return state
+        # print(f"大模型最终决策结果: {final_result}")
+        return {'final_recommendation': final_result}
+
+    @on_event_loop
+    async def analyze_fused_async(self, state: MessageState) -> Dict[str, Any]:
+        """合并模式：一次请求完成所有角色的分析，只返回最终决策"""
+        prompt = f"""{self._fundamental_prompt(state)}
+{self._technical_prompt(state, self.llm_service)}"""
+        messages = [
+            SystemMessage(content=FUSED_SYSTEM_PROMPT),
+            HumanMessage(content=prompt)
+        ]
+        if settings.llm_structured_output:
+            fused_result = await self.structured_fused_llm.ainvoke(messages)
+        else:
+            fused_result = FusedAnalysisResult.model_validate(extract_json(await self.llm_service.astream_json(messages)))
+        return fused_result.final_recommendation.model_dump()
 
     def analyze(self, stock_data: Dict[str, Any],
                 history_data: List[Dict[str, Any]],
                 stock_info: Dict[str, Any]) -> Dict[str, Any]:
-        """执行多角色分析"""
+        """执行多角色分析（同步入口，图在共享的后台事件循环中执行，可在多个工作线程中并发调用）"""
+        return run_coroutine(self.analyze_async(stock_data, history_data, stock_info))
+
+    @on_event_loop
+    async def analyze_async(self, stock_data: Dict[str, Any],
+                            history_data: List[Dict[str, Any]],
+                            stock_info: Dict[str, Any]) -> Dict[str, Any]:
+        """异步执行多角色分析，并行分支会并发请求大模型"""
 
         # 获取当前日期，作为缓存键的一部分
         current_date = time.strftime("%Y-%m-%d")
         # 构建缓存键：股票代码+日期+模式
-        cache_key = f"{stock_data.get('code', '')}_{current_date}_multi"
+        mode = "multi_fused" if settings.multi_role_fused else "multi"
+        cache_key = f"{stock_data.get('code', '')}_{current_date}_{mode}"
         
         # 检查缓存中是否存在有效的分析结果
-        if cache_key in llm_cache:
-            cached_result, timestamp = llm_cache[cache_key]
-            # 检查缓存是否过期
-            if time.time() - timestamp < CACHE_EXPIRY:
-                return cached_result
+        cached_result = get_cached_result(cache_key)
+        if cached_result is not None:
+            return cached_result
 
         try:
-            result = self.graph.invoke(MessageState(
+            # 只传入输入字段，各分析结果字段由对应节点写入
+            state = MessageState(
                 stock_data=stock_data,
                 history_data=history_data,
                 stock_info=stock_info,
-                fundamental_analyst="",
-                technical_analysis_node="",
-            ))
-            # 直接从结果字典中获取final_recommendation
-            # print(f"最终推荐结果: {result['final_recommendation']}")
-            final_result = result["final_recommendation"]
+            )
+            if settings.multi_role_fused:
+                final_result = await self.analyze_fused_async(state)
+            else:
+                result = await self.graph.ainvoke(state, config={"configurable": {"llm_service": self.llm_service}})
+                # 直接从结果字典中获取final_recommendation
+                # print(f"最终推荐结果: {result['final_recommendation']}")
+                final_result = result["final_recommendation"]
             
             # 将结果存入缓存
-            llm_cache[cache_key] = (final_result, time.time())
+            set_cached_result(cache_key, final_result)
             return final_result
         except Exception as e:
-            print(f"多角色分析错误: {e}")
-            return self.llm_service.analyze_stock(stock_data, history_data, stock_info)
+            log.error("多角色分析错误: %s", e)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                _FALLBACK_POOL, self.llm_service.analyze_stock, stock_data, history_data, stock_info
+            )
+
+    @on_event_loop
+    async def analyze_many(self, stocks: List[Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]],
+                           concurrency: int = None) -> List[Dict[str, Any]]:
+        """并发执行多只股票的多角色分析
+
+        Args:
+            stocks: (实时数据, 历史数据, 基本信息) 元组列表
+            concurrency: 同时进行分析的股票数量上限，默认使用settings.llm_concurrency
+
+        Returns:
+            与输入顺序一致的分析结果列表
+        """
+        semaphore = asyncio.Semaphore(concurrency or settings.llm_concurrency)
+
+        async def analyze_one(stock_data, history_data, stock_info):
+            async with semaphore:
+                return await self.analyze_async(stock_data, history_data, stock_info)
+
+        return await asyncio.gather(*(analyze_one(*stock) for stock in stocks))
+
+    def analyze_many_fallback(self, stocks: List[Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """在共享线程池中并发执行单次分析，用于多角色分析整体不可用时的批量回退
+
+        Returns:
+            与输入顺序一致的分析结果列表
+        """
+        futures = {
+            _FALLBACK_POOL.submit(self.llm_service.analyze_stock, *stock): i
+            for i, stock in enumerate(stocks)
+        }
+        results: List[Dict[str, Any]] = [None] * len(stocks)
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+        return results
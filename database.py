@@ -1,55 +1,81 @@
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
-from functools import lru_cache
+from itertools import batched, groupby
+from threading import Lock
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from cachetools import TTLCache, cached
+from cachetools.keys import methodkey
+from sqlalchemy import bindparam, text
+
+from engine import engine, stream_engine, SessionLocal
+
+# 模块级缓存，按数据更新频率设置过期时间；缓存键不包含self，不会持有Database实例
+# 历史日线每天更新，缓存1小时
+history_cache = TTLCache(maxsize=5000, ttl=60 * 60)
+# 股票基本信息基本不变，缓存1天
+info_cache = TTLCache(maxsize=20000, ttl=24 * 60 * 60)
+_history_cache_lock = Lock()
+_info_cache_lock = Lock()
+
+# IN (...) 查询每组的代码数量，避免单条SQL超过MySQL max_allowed_packet
+IN_CLAUSE_BATCH_SIZE = 500
 
-from engine import engine,SessionLocal
-import pandas as pd
 
 class Database:
     """数据库操作类"""
     def __init__(self):
         self.engine = engine
+        self.stream_engine = stream_engine
         self.sessionLocal = SessionLocal
 
-    @lru_cache(maxsize=1000)
-    def _get_stock_history_cache(self, full_code: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+    def _fetch_all(self, sql, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """执行查询并以字典列表返回，直接使用行映射，避免构建DataFrame"""
+        with self.engine.connect() as conn:
+            return [dict(row) for row in conn.execute(sql, params or {}).mappings()]
+
+    def _fetch_one(self, sql, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """执行查询并返回第一行，没有结果时返回None"""
+        with self.engine.connect() as conn:
+            row = conn.execute(sql, params or {}).mappings().first()
+            return dict(row) if row else None
+
+    @cached(history_cache, key=methodkey, lock=_history_cache_lock)
+    def _get_stock_history_cache(self, stock_code: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
         """获取股票历史数据（带缓存）"""
-        sql_str =  f"""
-        SELECT date, code, open, high, low, close, preclose, volume, amount,
-                   adjustflag, turn, tradestatus, pctChg, peTTM, pbMRQ, psTTM,
-                   pcfNcfTTM, isST, update_time
-            FROM stock_daily
-            WHERE code = '{full_code}' 
-            AND date >= '{start_date}'
-            AND date <= '{end_date}'
-            ORDER BY date DESC
-        """
-        return pd.read_sql(sql_str, self.engine).to_dict(orient="records")
+        # 通过stock_info关联出full_code，一次查询完成，不再先单独查询基本信息
+        sql = text("""
+        SELECT sd.date, sd.code, sd.open, sd.high, sd.low, sd.close, sd.preclose, sd.volume, sd.amount,
+                   sd.adjustflag, sd.turn, sd.tradestatus, sd.pctChg, sd.peTTM, sd.pbMRQ, sd.psTTM,
+                   sd.pcfNcfTTM, sd.isST, sd.update_time
+            FROM stock_daily sd
+            JOIN stock_info si ON si.full_code = sd.code
+            WHERE si.code = :code
+            AND sd.date >= :start_date
+            AND sd.date <= :end_date
+            ORDER BY sd.date DESC
+        """)
+        params = {'code': stock_code, 'start_date': start_date, 'end_date': end_date}
+        return self._fetch_all(sql, params)
     
     def get_stock_history(self, stock_code: str, days: int = 30) -> List[Dict[str, Any]]:
         """获取股票历史数据"""
-        stock_info = self.get_stock_info(stock_code)
-        if not stock_info:
-            return []
-        full_code = stock_info.get('full_code')
         end = datetime.now()
         start = end - timedelta(days=days)
         start_date = start.strftime('%Y-%m-%d')
         end_date = end.strftime('%Y-%m-%d')
-        return self._get_stock_history_cache(full_code, start_date, end_date)
+        return self._get_stock_history_cache(stock_code, start_date, end_date)
 
-    @lru_cache(maxsize=1000)
+    @cached(info_cache, key=methodkey, lock=_info_cache_lock)
     def _get_stock_info_cache(self, stock_code: str) -> Optional[Dict[str, Any]]:
         """获取股票基本信息（带缓存）"""
-        sql_str = f"""
+        sql = text("""
         SELECT code, name, total_equity, liquidity, total_value, liquidity_value,
                    sector, ipo_date, update_time, full_code, exchange_code
             FROM stock_info
-            WHERE code = '{stock_code}'
-            ORDER BY code
-        """
-        result = pd.read_sql(sql_str, self.engine).to_dict(orient="records")
-        return result[0] if result else None
+            WHERE code = :code
+            LIMIT 1
+        """)
+        return self._fetch_one(sql, {'code': stock_code})
     
     def get_stock_info(self, stock_code: str) -> Optional[Dict[str, Any]]:
         """获取股票基本信息"""
@@ -61,21 +87,16 @@ class Database:
             return {}
         
         results_dict = {}
-        # 分组处理，每组最多1000个股票代码，避免SQL查询过长
-        batch_size = 1000
-        for i in range(0, len(stock_codes), batch_size):
-            batch_codes = stock_codes[i:i+batch_size]
-            # 使用IN子句批量查询
-            codes_str = "'" + "','".join(batch_codes) + "'"
-            sql_str = f"""
-            SELECT code, name, total_equity, liquidity, total_value, liquidity_value,
-                       sector, ipo_date, update_time, full_code, exchange_code
-                FROM stock_info
-                WHERE code IN ({codes_str})
-                ORDER BY code
-            """
-            
-            results = pd.read_sql(sql_str, self.engine).to_dict(orient="records")
+        # 使用expanding参数绑定IN子句，按组查询
+        sql = text("""
+        SELECT code, name, total_equity, liquidity, total_value, liquidity_value,
+                   sector, ipo_date, update_time, full_code, exchange_code
+            FROM stock_info
+            WHERE code IN :codes
+            ORDER BY code
+        """).bindparams(bindparam("codes", expanding=True))
+        for batch_codes in batched(stock_codes, IN_CLAUSE_BATCH_SIZE):
+            results = self._fetch_all(sql, {'codes': list(batch_codes)})
             # 合并结果
             for result in results:
                 results_dict[result['code']] = result
@@ -84,42 +105,36 @@ class Database:
 
     def get_batch_stock_history(self, full_codes: List[str], days: int = 30) -> Dict[str, List[Dict[str, Any]]]:
         """批量获取股票历史数据"""
+        return dict(self.iter_batch_stock_history(full_codes, days))
+
+    def iter_batch_stock_history(self, full_codes: List[str], days: int = 30) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """逐只股票产出历史数据 (full_code, 按日期倒序的历史记录)，结果集不会整体驻留内存"""
         if not full_codes:
-            return {}
+            return
         
-        grouped_results = {}
-        # 分组处理，每组最多500个股票代码，避免SQL查询过长和内存占用过高
-        batch_size = 500
         end = datetime.now()
         start = end - timedelta(days=days)
         start_date = start.strftime('%Y-%m-%d')
         end_date = end.strftime('%Y-%m-%d')
         
-        for i in range(0, len(full_codes), batch_size):
-            batch_codes = full_codes[i:i+batch_size]
-            # 使用IN子句批量查询
-            codes_str = "'" + "','".join(batch_codes) + "'"
-            sql_str =  f"""
-            SELECT date, code, open, high, low, close, preclose, volume, amount,
-                       adjustflag, turn, tradestatus, pctChg, peTTM, pbMRQ, psTTM,
-                       pcfNcfTTM, isST, update_time
-                FROM stock_daily
-                WHERE code IN ({codes_str})
-                AND date >= '{start_date}'
-                AND date <= '{end_date}'
-                ORDER BY code, date DESC
-            """
-            
-            results = pd.read_sql(sql_str, self.engine).to_dict(orient="records")
-            
-            # 按股票代码分组并合并结果
-            for result in results:
-                code = result['code']
-                if code not in grouped_results:
-                    grouped_results[code] = []
-                grouped_results[code].append(result)
-        
-        return grouped_results
+        # 使用expanding参数绑定IN子句，按组查询，避免SQL查询过长和内存占用过高
+        sql = text("""
+        SELECT date, code, open, high, low, close, preclose, volume, amount,
+                   adjustflag, turn, tradestatus, pctChg, peTTM, pbMRQ, psTTM,
+                   pcfNcfTTM, isST, update_time
+            FROM stock_daily
+            WHERE code IN :codes
+            AND date >= :start_date
+            AND date <= :end_date
+            ORDER BY code, date DESC
+        """).bindparams(bindparam("codes", expanding=True))
+        for batch_codes in batched(full_codes, IN_CLAUSE_BATCH_SIZE):
+            params = {'codes': list(batch_codes), 'start_date': start_date, 'end_date': end_date}
+            with self.stream_engine.connect() as conn:
+                rows = conn.execution_options(yield_per=1000).execute(sql, params).mappings()
+                # 结果已按code排序，同一股票的记录连续出现，直接顺序分组
+                for code, group in groupby(rows, key=lambda row: row['code']):
+                    yield code, [dict(row) for row in group]
 
     def get_all_stock_codes(self) -> List[str]:
         """获取所有股票代码"""
@@ -127,4 +142,6 @@ class Database:
         SELECT code
             FROM stock_info
         """
-        return pd.read_sql(sql_str, self.engine)["code"].tolist()
+        # 全表扫描使用流式读取，每次从服务端取1000行
+        with self.stream_engine.connect() as conn:
+            return list(conn.execution_options(yield_per=1000).execute(text(sql_str)).scalars())
@@ -10,6 +10,18 @@ def make_url() -> str:
     )
 
 
-engine = create_engine(make_url(), pool_pre_ping=True, echo=False, future=True)
+# 连接池按并发分析的规模设置，避免并行的图节点和批量查询在默认池（5+10）上排队
+engine = create_engine(
+    make_url(),
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=True,
+    echo=False,
+    future=True,
+    connect_args={"charset": "utf8mb4"},
+)
+# 与engine共享连接池，使用服务端游标（pymysql SSCursor）逐批读取大结果集，避免一次性缓冲到内存
+stream_engine = engine.execution_options(stream_results=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
 
@@ -1,60 +1,387 @@
-from typing import Dict, Any, List
+from functools import lru_cache, wraps
+from typing import Awaitable, Callable, Dict, Any, List, Literal, Optional, Tuple, TypeVar
+import asyncio
+import hashlib
+import json
+import logging
 import os
 import time
+from threading import Lock, Thread
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+import numpy as np
+from pydantic import AliasChoices, BaseModel, Field, ValidationError
 from setting import settings
 
-# 缓存字典，键为股票代码+日期+模式，值为(结果, 时间戳)
-llm_cache = {}
+log = logging.getLogger(__name__)
+
 # 缓存有效期（秒），设置为1天
 CACHE_EXPIRY = 24 * 60 * 60
+# 缓存最大条目数，超出后按LRU淘汰
+CACHE_MAXSIZE = 10000
+# 全局唯一的分析结果缓存，键为股票代码+日期+模式，过期条目由TTLCache自动淘汰
+llm_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_EXPIRY)
+# TTLCache本身不是线程安全的，分析在多线程中并发执行，读写都需要加锁
+_cache_lock = Lock()
 
+# 提示词详细程度：short只带最近3天收盘，medium带最近7天，full带最近15天K线和市值信息
+PromptMode = Literal["short", "medium", "full"]
+PROMPT_HISTORY_DAYS: Dict[str, int] = {"short": 3, "medium": 7, "full": 15}
 
-class LLMService:
-    def __init__(self):
-        self.llm = ChatOpenAI(
+
+def get_cached_result(cache_key: str) -> Optional[Dict[str, Any]]:
+    """读取缓存的分析结果，不存在或已过期时返回None"""
+    with _cache_lock:
+        return llm_cache.get(cache_key)
+
+
+def set_cached_result(cache_key: str, result: Dict[str, Any]):
+    """写入分析结果缓存"""
+    with _cache_lock:
+        llm_cache[cache_key] = result
+
+# 静态提示词放在SystemMessage中且每次调用字节完全一致，便于服务端前缀缓存命中；
+# 每只股票的动态数据只放在HumanMessage中
+_ANALYSIS_FIELDS = """- recommendation: 买入/卖出/保持
+- reason: 推荐原因
+- action: 买/卖/保持
+- predicted_price: T+1预测价格
+- predicted_buy_price: T+1预测买入价
+- predicted_sell_price: T+1预测卖出价
+- confidence: 0-1的信心值"""
+
+ANALYSIS_SYSTEM_PROMPT = f"""你是一个专业的股票分析师，需要基于股票历史数据、实时数据和基本面信息进行分析。
+
+请基于用户提供的股票数据（基本信息、实时数据、近几天走势）进行T+1选股分析，并给出T+1交易建议，包括：
+{_ANALYSIS_FIELDS}
+
+请严格以JSON格式返回，不要添加其他内容。"""
+
+BATCH_ANALYSIS_SYSTEM_PROMPT = f"""你是一个专业的股票分析师，需要基于股票历史数据、实时数据和基本面信息进行分析。
+
+用户会提供多只股票的数据，每只股票以编号[i]开头。请分别对每只股票进行T+1选股分析，每个结果包含：
+{_ANALYSIS_FIELDS}
+
+请严格以JSON格式返回 {{"results": [...]}}，results数组的第i个元素对应编号[i]的股票，数组长度与股票数量一致，不要添加其他内容。"""
+
+
+class AnalysisResult(BaseModel):
+    """T+1分析结果，兼容大模型返回的中英文字段名"""
+    recommendation: str = Field('保持', validation_alias=AliasChoices('recommendation', '建议'),
+                                description='买入/卖出/保持')
+    reason: str = Field('分析完成', validation_alias=AliasChoices('reason', '推荐原因'),
+                        description='推荐原因')
+    action: str = Field('保持', validation_alias=AliasChoices('action', '动作'),
+                        description='买/卖/保持')
+    predicted_price: float = Field(0, validation_alias=AliasChoices('predicted_price', '预测价格', '预测价格_T+1'),
+                                   description='T+1预测价格')
+    predicted_buy_price: float = Field(0, validation_alias=AliasChoices('predicted_buy_price', '预测买入价格', '预测买入价格_T+1'),
+                                       description='T+1预测买入价')
+    predicted_sell_price: float = Field(0, validation_alias=AliasChoices('predicted_sell_price', '预测卖出价格', '预测卖出价格_T+1'),
+                                        description='T+1预测卖出价')
+    confidence: float = Field(0.5, validation_alias=AliasChoices('confidence', '预测信心'),
+                              description='0-1的信心值')
+
+
+class BatchAnalysisResult(BaseModel):
+    """批量分析结果，results按股票编号排列"""
+    results: List[AnalysisResult]
+
+
+_json_decoder = json.JSONDecoder()
+
+
+def extract_json(text: str) -> Any:
+    """从大模型响应中提取第一个完整的JSON对象
+
+    从第一个'{'开始用raw_decode解码，忽略对象前后的多余文本，避免正则回溯。
+    """
+    idx = text.find('{')
+    if idx < 0:
+        raise ValueError("响应中没有JSON对象")
+    obj, _ = _json_decoder.raw_decode(text, idx)
+    return obj
+
+
+def _json_complete(buffer: str) -> bool:
+    """判断流式缓冲区中是否已经收到完整的顶层JSON对象
+
+    括号计数只作为快速预检，字符串中的括号会使其误判，预检通过后再用raw_decode确认能完整解码。
+    """
+    if not ('{' in buffer and buffer.count('{') == buffer.count('}') and buffer.rstrip().endswith('}')):
+        return False
+    try:
+        _json_decoder.raw_decode(buffer, buffer.find('{'))
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+def parse_response(response: str) -> Dict[str, Any]:
+    """解析大模型响应，无法解析时返回默认结果"""
+    try:
+        return AnalysisResult.model_validate(extract_json(response)).model_dump()
+    except ValueError:
+        # json.JSONDecodeError和pydantic.ValidationError都是ValueError的子类
+        return AnalysisResult().model_dump()
+
+
+def parse_batch_response(response: str, count: int) -> List[Optional[Dict[str, Any]]]:
+    """解析批量分析响应，返回长度为count的列表，无法解析的位置为None"""
+    results: List[Optional[Dict[str, Any]]] = [None] * count
+    try:
+        items = extract_json(response).get('results', [])
+    except (ValueError, AttributeError):
+        return results
+    for i, item in enumerate(items[:count]):
+        try:
+            results[i] = AnalysisResult.model_validate(item).model_dump()
+        except ValidationError:
+            pass
+    return results
+
+
+class SemanticCache:
+    """语义缓存：按分组键（股票代码+提示词模式）分组，提示词向量余弦相似度超过阈值时复用已有分析结果
+
+    同一只股票在相邻交易日的提示词往往只有少量数字变化，精确缓存无法命中。
+    只在同一分组内比较相似度，避免不同股票或不同详细程度的结果之间误命中。
+    只有数字变化时向量几乎不变，条目超过有效期后淘汰，避免长期复用过时的建议。
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries_per_code: int = 32, ttl: float = CACHE_EXPIRY):
+        self.threshold = threshold
+        self.max_entries_per_code = max_entries_per_code
+        self.ttl = ttl
+        self.embeddings = OpenAIEmbeddings(
             base_url=settings.llm_base_url,
             api_key=settings.llm_api_key,
-            model=settings.llm_model,
-            temperature=0.1
+            model=settings.embedding_model,
+            # 非OpenAI后端不能用tiktoken预先切分，直接发送原始文本
+            check_embedding_ctx_length=False
         )
+        # 分组键 -> (归一化后的向量矩阵, 结果列表, 提示词哈希列表, 写入时间数组)
+        self._entries: Dict[str, Tuple[np.ndarray, List[Dict[str, Any]], List[str], np.ndarray]] = {}
+        self._lock = Lock()
+
+    def _fresh_entry(self, code: str) -> Optional[Tuple[np.ndarray, List[Dict[str, Any]], List[str], np.ndarray]]:
+        """取出股票的缓存条目并淘汰过期的记录，调用方需持有锁"""
+        entry = self._entries.get(code)
+        if entry is None:
+            return None
+        matrix, results, hashes, created = entry
+        fresh = created >= time.monotonic() - self.ttl
+        if fresh.all():
+            return entry
+        if not fresh.any():
+            del self._entries[code]
+            return None
+        keep = np.flatnonzero(fresh)
+        entry = (matrix[keep], [results[i] for i in keep], [hashes[i] for i in keep], created[keep])
+        self._entries[code] = entry
+        return entry
+
+    @staticmethod
+    def _normalize(prompt: str) -> str:
+        """归一化提示词，去除空白差异"""
+        return " ".join(prompt.split())
+
+    def _embed(self, prompt: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(prompt), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, code: str, prompt: str) -> Tuple[Optional[Dict[str, Any]], Optional[np.ndarray]]:
+        """查找相似提示词的缓存结果
+
+        Returns:
+            (命中的结果或None, 本次提示词的向量；哈希精确命中时为None)，向量可传给add避免重复计算
+        """
+        prompt = self._normalize(prompt)
+        prompt_hash = hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+        with self._lock:
+            entry = self._fresh_entry(code)
+            if entry and prompt_hash in entry[2]:
+                return entry[1][entry[2].index(prompt_hash)], None
+
+        vector = self._embed(prompt)
+        with self._lock:
+            entry = self._fresh_entry(code)
+            if entry:
+                matrix, results, _, _ = entry
+                # 向量已归一化，内积即余弦相似度
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    return results[best], vector
+        return None, vector
+
+    def add(self, code: str, prompt: str, result: Dict[str, Any], vector: Optional[np.ndarray] = None):
+        """写入缓存，同时淘汰过期条目，超过单只股票上限时淘汰最早的条目"""
+        prompt = self._normalize(prompt)
+        prompt_hash = hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+        if vector is None:
+            vector = self._embed(prompt)
+        now = np.array([time.monotonic()])
+        with self._lock:
+            entry = self._fresh_entry(code)
+            if entry:
+                matrix, results, hashes, created = entry
+                matrix = np.vstack([matrix, vector])[-self.max_entries_per_code:]
+                results = (results + [result])[-self.max_entries_per_code:]
+                hashes = (hashes + [prompt_hash])[-self.max_entries_per_code:]
+                created = np.concatenate([created, now])[-self.max_entries_per_code:]
+            else:
+                matrix, results, hashes, created = vector[np.newaxis, :], [result], [prompt_hash], now
+            self._entries[code] = (matrix, results, hashes, created)
+
+
+@lru_cache(maxsize=1)
+def get_chat_model() -> ChatOpenAI:
+    """全局共享的大模型客户端，所有LLMService实例复用同一个HTTP连接池"""
+    return ChatOpenAI(
+        base_url=settings.llm_base_url,
+        api_key=settings.llm_api_key,
+        model=settings.llm_model,
+        temperature=0.1
+    )
+
+
+T = TypeVar("T")
+
+# 后台事件循环：langchain-openai的异步HTTP连接池在进程内共享，绑定在首次使用它的事件循环上，
+# 每次asyncio.run新建循环会使连接池失效（Event loop is closed），所有异步大模型调用都提交到这一个长期运行的循环
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+_event_loop_lock = Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """获取全局共享的后台事件循环，首次调用时在守护线程中启动"""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            Thread(target=_event_loop.run_forever, name="llm-event-loop", daemon=True).start()
+        return _event_loop
+
+
+def run_coroutine(coro: Awaitable[T]) -> T:
+    """在后台事件循环中执行协程并阻塞等待结果，可在任意线程中调用（不能在后台事件循环内部调用）"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+def on_event_loop(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """装饰会调用大模型的公开协程：调用方不在共享后台事件循环中时（例如自行asyncio.run），转到该循环中执行并等待结果"""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = get_event_loop()
+        if asyncio.get_running_loop() is loop:
+            return await func(*args, **kwargs)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(func(*args, **kwargs), loop))
+    return wrapper
+
+
+@lru_cache(maxsize=1)
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """全局共享的语义缓存，未启用时返回None"""
+    if not settings.semantic_cache_enabled:
+        return None
+    return SemanticCache(settings.semantic_cache_threshold, ttl=settings.semantic_cache_ttl)
+
+
+class LLMService:
+    def __init__(self):
+        self.llm = get_chat_model()
+        # 结构化输出：由服务端按JSON Schema约束生成，直接得到可解析的结果
+        self.structured_llm = self.llm.with_structured_output(AnalysisResult)
+        self.structured_batch_llm = self.llm.with_structured_output(BatchAnalysisResult)
+        self.semantic_cache = get_semantic_cache()
+
+    def invoke_analysis(self, messages: List[BaseMessage]) -> Dict[str, Any]:
+        """调用大模型并返回分析结果字典"""
+        if settings.llm_structured_output:
+            return self.structured_llm.invoke(messages).model_dump()
+        return parse_response(self.stream_json(messages))
+
+    @on_event_loop
+    async def ainvoke_analysis(self, messages: List[BaseMessage]) -> Dict[str, Any]:
+        """异步调用大模型并返回分析结果字典"""
+        if settings.llm_structured_output:
+            return (await self.structured_llm.ainvoke(messages)).model_dump()
+        return parse_response(await self.astream_json(messages))
+
+    def stream_json(self, messages: List[BaseMessage]) -> str:
+        """流式调用大模型，收到完整的顶层JSON对象后立即停止接收"""
+        buffer = ""
+        for chunk in self.llm.stream(messages):
+            buffer += chunk.content
+            if _json_complete(buffer):
+                break
+        return buffer
+
+    @on_event_loop
+    async def astream_json(self, messages: List[BaseMessage]) -> str:
+        """异步流式调用大模型，收到完整的顶层JSON对象后立即停止接收"""
+        buffer = ""
+        async for chunk in self.llm.astream(messages):
+            buffer += chunk.content
+            if _json_complete(buffer):
+                break
+        return buffer
 
     def analyze_stock(self, stock_data: Dict[str, Any],
                       history_data: List[Dict[str, Any]],
-                      stock_info: Dict[str, Any]) -> Dict[str, Any]:
-        """使用大模型分析股票数据"""
+                      stock_info: Dict[str, Any],
+                      mode: PromptMode = "short") -> Dict[str, Any]:
+        """使用大模型分析股票数据
+
+        Args:
+            mode: 提示词详细程度，见PROMPT_HISTORY_DAYS
+        """
         
         # 获取当前日期，作为缓存键的一部分
         current_date = time.strftime("%Y-%m-%d")
         # 构建缓存键：股票代码+日期+模式
-        cache_key = f"{stock_data.get('code', '')}_{current_date}_single"
+        cache_key = f"{stock_data.get('code', '')}_{current_date}_single_{mode}"
         
         # 检查缓存中是否存在有效的分析结果
-        if cache_key in llm_cache:
-            cached_result, timestamp = llm_cache[cache_key]
-            # 检查缓存是否过期
-            if time.time() - timestamp < CACHE_EXPIRY:
-                return cached_result
+        cached_result = get_cached_result(cache_key)
+        if cached_result is not None:
+            return cached_result
         
-        prompt = self._build_analysis_prompt(stock_data, history_data, stock_info)
+        prompt = self._build_analysis_prompt(stock_data, history_data, stock_info, mode)
+
+        # 精确缓存未命中时，再检查同一股票、同一模式下是否有相似的历史提示词
+        semantic_key = f"{stock_data.get('code', '')}_{mode}"
+        vector = None
+        if self.semantic_cache:
+            try:
+                cached_result, vector = self.semantic_cache.lookup(semantic_key, prompt)
+                if cached_result is not None:
+                    set_cached_result(cache_key, cached_result)
+                    return cached_result
+            except Exception as e:
+                log.warning("语义缓存查询错误: %s", e)
 
         try:
-            response = self.llm.invoke([
-                SystemMessage(content="你是一个专业的股票分析师，需要基于股票历史数据、实时数据和基本面信息进行分析。"),
+            result = self.invoke_analysis([
+                SystemMessage(content=ANALYSIS_SYSTEM_PROMPT),
                 HumanMessage(content=prompt)
             ])
-            # 只打印关键信息，减少输出开销
-            # print(f"大模型分析结果: {response.content}")
-            result = self._parse_response(response.content)
             
             # 将结果存入缓存
-            llm_cache[cache_key] = (result, time.time())
+            set_cached_result(cache_key, result)
+            if self.semantic_cache:
+                try:
+                    self.semantic_cache.add(semantic_key, prompt, result, vector)
+                except Exception as e:
+                    log.warning("语义缓存写入错误: %s", e)
             return result
 
         except Exception as e:
-            print(f"大模型分析错误: {e}")
+            log.error("大模型分析错误: %s", e)
             return {
                 'recommendation': '保持',
                 'reason': '分析过程中出现错误',
@@ -65,75 +392,129 @@ class LLMService:
                 'confidence': 0.5
             }
 
+    def analyze_stocks_batch(self, stocks: List[Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]],
+                             mode: PromptMode = "short") -> List[Dict[str, Any]]:
+        """将多只股票合并到一次大模型请求中分析
+
+        Args:
+            stocks: (实时数据, 历史数据, 基本信息) 元组列表
+            mode: 提示词详细程度，见PROMPT_HISTORY_DAYS
+
+        Returns:
+            与输入顺序一致的分析结果列表
+        """
+        if not stocks:
+            return []
+
+        current_date = time.strftime("%Y-%m-%d")
+        cache_keys = [f"{stock_data.get('code', '')}_{current_date}_single_{mode}" for stock_data, _, _ in stocks]
+        results: List[Dict[str, Any]] = [None] * len(stocks)
+
+        # 先从缓存中取出已有结果，只把未命中的股票打包发送
+        pending = []
+        for i, cache_key in enumerate(cache_keys):
+            cached_result = get_cached_result(cache_key)
+            if cached_result is not None:
+                results[i] = cached_result
+            else:
+                pending.append(i)
+
+        if pending:
+            prompt = self._build_batch_prompt([stocks[i] for i in pending], mode)
+            try:
+                messages = [
+                    SystemMessage(content=BATCH_ANALYSIS_SYSTEM_PROMPT),
+                    HumanMessage(content=prompt)
+                ]
+                if settings.llm_structured_output:
+                    items = self.structured_batch_llm.invoke(messages).results[:len(pending)]
+                    batch_results = [item.model_dump() for item in items]
+                    batch_results += [None] * (len(pending) - len(batch_results))
+                else:
+                    batch_results = parse_batch_response(self.stream_json(messages), len(pending))
+            except Exception as e:
+                log.error("大模型批量分析错误: %s", e)
+                batch_results = [None] * len(pending)
+
+            for i, result in zip(pending, batch_results):
+                if result is None:
+                    # 批量结果缺失或解析失败时，退回单只股票分析
+                    results[i] = self.analyze_stock(*stocks[i], mode=mode)
+                else:
+                    set_cached_result(cache_keys[i], result)
+                    results[i] = result
+
+        return results
+
     def _build_analysis_prompt(self, stock_data: Dict[str, Any],
                                history_data: List[Dict[str, Any]],
-                               stock_info: Dict[str, Any]) -> str:
+                               stock_info: Dict[str, Any],
+                               mode: PromptMode = "short") -> str:
         """构建分析提示词"""
 
-        # 只取最近3天的历史数据，进一步减少上下文长度
-        history_summary = "\n".join([
-            f"{d['date']}: {round(d['close'], 2)}({d['pctChg']}%)"
-            for d in history_data[:3]  # 只取最近3天的数据
-        ])
+        # 按模式截取历史数据，short模式只取最近3天，尽量减少上下文长度
+        days = PROMPT_HISTORY_DAYS[mode]
+        history_summary = self._format_history(history_data, days, ohlc=mode == "full")
 
-        prompt = f"""
-请基于以下股票数据进行T+1选股分析：
+        market_value = ""
+        if mode == "full":
+            market_value = f"""
+- 总市值: {stock_data.get('total_market_value', 0)}万元
+- 流通市值: {stock_data.get('circulating_market_value', 0)}万元"""
 
-基本信息：
+        prompt = f"""基本信息：
 - 代码: {stock_data.get('code', '')}
 - 名称: {stock_data.get('name', '')}
 - 行业: {stock_info.get('sector', '') if stock_info else '未知'}
 - PE: {stock_data.get('pe_ratio', 0)}
-- PB: {stock_data.get('pb_ratio', 0)}
+- PB: {stock_data.get('pb_ratio', 0)}{market_value}
 
 实时数据：
 - 现价: {stock_data.get('current_price', 0)}
 - 涨跌幅: {stock_data.get('change_percent', 0)}%
 - 成交量: {stock_data.get('volume_hand', 0)}手
 
-近3天走势：
+近{days}天走势：
 {history_summary}
-
-请给出T+1交易建议，包括：
-- recommendation: 买入/卖出/保持
-- reason: 推荐原因
-- action: 买/卖/保持
-- predicted_price: T+1预测价格
-- predicted_buy_price: T+1预测买入价
-- predicted_sell_price: T+1预测卖出价
-- confidence: 0-1的信心值
-
-请严格以JSON格式返回，不要添加其他内容。
 """
         return prompt
 
-    def _parse_response(self, response: str) -> Dict[str, Any]:
-        """解析大模型响应"""
-        import json
-        import re
+    @staticmethod
+    def _format_history(history_data: List[Dict[str, Any]], n: int, ohlc: bool = False) -> str:
+        """将最近n天历史数据压缩为CSV文本，减少提示词token
 
-        try:
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                result = json.loads(json_match.group())
-                return {
-                    'recommendation': result.get('建议', '保持'),
-                    'reason': result.get('推荐原因', '分析完成'),
-                    'action': result.get('动作', '保持'),
-                    'predicted_price': float(result.get('预测价格',result.get('预测价格_T+1', 0))),
-                    'predicted_buy_price': float(result.get('预测买入价格', result.get('预测买入价格_T+1', 0))),
-                    'predicted_sell_price': float(result.get('预测卖出价格', result.get('预测卖出价格_T+1', 0))),
-                    'confidence': float(result.get('预测信心', -0.5))
-                }
-        except (json.JSONDecodeError, ValueError):
-            pass
+        价格保留2位小数，涨跌幅保留1位，成交量以万股为单位；ohlc为False时只保留收盘价。
+        """
+        def fmt(value, digits: int) -> str:
+            return f"{value:.{digits}f}" if value is not None else ""
+
+        header = "日期,开盘,最高,最低,收盘,涨跌幅%,成交量(万股)" if ohlc else "日期,收盘,涨跌幅%,成交量(万股)"
+        lines = [header]
+        for d in history_data[:n]:
+            prices = (d['open'], d['high'], d['low'], d['close']) if ohlc else (d['close'],)
+            volume = str(int(d['volume']) // 10000) if d['volume'] is not None else ""
+            lines.append(",".join([str(d['date']), *(fmt(p, 2) for p in prices), fmt(d['pctChg'], 1), volume]))
+        return "\n".join(lines)
+
+    def _build_batch_prompt(self, stocks: List[Tuple[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]]],
+                            mode: PromptMode = "short") -> str:
+        """构建批量分析提示词，每只股票一个编号数据块"""
+        days = PROMPT_HISTORY_DAYS[mode]
+        blocks = []
+        for index, (stock_data, history_data, stock_info) in enumerate(stocks):
+            history_summary = self._format_history(history_data, days, ohlc=mode == "full")
+            blocks.append(f"""
+[{index}] {stock_data.get('code', '')} {stock_data.get('name', '')}
+- 行业: {stock_info.get('sector', '') if stock_info else '未知'}
+- PE: {stock_data.get('pe_ratio', 0)}
+- PB: {stock_data.get('pb_ratio', 0)}
+- 现价: {stock_data.get('current_price', 0)}
+- 涨跌幅: {stock_data.get('change_percent', 0)}%
+- 成交量: {stock_data.get('volume_hand', 0)}手
+近{days}天走势：
+{history_summary}""")
 
-        return {
-            'recommendation': '保持',
-            'reason': '分析完成',
-            'action': '保持',
-            'predicted_price': 0,
-            'predicted_buy_price': 0,
-            'predicted_sell_price': 0,
-            'confidence': 0.5
-        }
\ No newline at end of file
+        prompt = f"""共{len(stocks)}只股票（编号0到{len(stocks) - 1}）：
+{"".join(blocks)}
+"""
+        return prompt
@@ -1,188 +1,349 @@
 import argparse
-import json
+import asyncio
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, Union
+
+import orjson
+from tqdm import tqdm
 
 from database import Database
 from realtime_stock_data import RealTimeStockDataFetcher
-from llm_service import LLMService
+from realtime_stock_data_async import get_multiple_stocks_data_async
+from llm_service import LLMService, on_event_loop, run_coroutine
 from analysis_framework import MultiRoleAnalyzer
+from setting import settings
+
+log = logging.getLogger(__name__)
+
+# 可交易性过滤阈值，不可交易的股票不调用大模型
+# 当日实时成交量不高于该值视为停牌（历史数据最新一条是上一交易日，不能用来判断当日是否停牌）
+SUSPENDED_MAX_VOLUME = 0
+# 现价与涨停价/跌停价相差不超过该值视为封板（A股最小价格变动单位为0.01元）
+LIMIT_PRICE_TOLERANCE = 0.005
+# 跳过分析的股票使用的建议和动作，与买入/卖出/保持区分开
+SKIPPED_RECOMMENDATION = '跳过'
+SKIPPED_ACTION = '不操作'
+
+
+@dataclass(slots=True)
+class StockAnalysisResult:
+    """单只股票的分析结果，orjson可直接序列化dataclass"""
+    code: str
+    name: str
+    analysis_date: str
+    current_price: float
+    change_percent: float
+    recommendation: str
+    reason: str
+    action: str
+    predicted_price: float
+    predicted_buy_price: float
+    predicted_sell_price: float
+    confidence: float
+
+
+@dataclass(slots=True)
+class StockAnalysisError:
+    """单只股票分析失败的结果"""
+    code: str
+    name: str
+    error: str
+
+
+StockResult = Union[StockAnalysisResult, StockAnalysisError]
+
+
+@dataclass(slots=True)
+class _AnalysisBatch:
+    """一批股票的分析上下文，同步和异步两条路径共用，只有调用大模型的执行方式不同"""
+    code_list: List[str]
+    info_list: List[Optional[Dict[str, Any]]]
+    real_time_data_dict: Dict[str, Dict[str, Any]]
+    history_data_dict: Dict[str, List[Dict[str, Any]]]
+    analysis_date: str
+    save_batch_size: Optional[int]
+    output_file: Optional[str]
+    # 需要调用大模型分析的股票下标
+    pending: List[int] = field(default_factory=list)
+    # 按输入顺序存放的结果，尚未完成的位置为None
+    results: List[Optional[StockResult]] = field(default_factory=list)
+    # 已完成的股票下标，按完成顺序排列，分批保存按该顺序写入
+    done: List[int] = field(default_factory=list)
+    # 已写入文件的结果数量，分批保存时只写入done[flushed:]对应的结果
+    flushed: int = 0
+
+    def complete(self, i: int, result: StockResult):
+        """记录第i只股票的结果"""
+        self.results[i] = result
+        self.done.append(i)
+
+    def inputs(self, i: int) -> Tuple[str, Dict[str, Any], Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """第i只股票的 (代码, 基本信息, 实时数据, 历史数据)"""
+        stock_info = self.info_list[i]
+        full_code = stock_info.get('full_code')
+        return (self.code_list[i], stock_info, self.real_time_data_dict.get(full_code),
+                self.history_data_dict.get(full_code, []))
 
 
 class StockAnalysisSystem:
-    def __init__(self, use_multi_role: bool = True):
+    def __init__(self, use_multi_role: bool = True, use_async: bool = False):
         self.db = Database()
         self.stock_fetcher = RealTimeStockDataFetcher()
         self.llm_service = LLMService()
         self.multi_analyzer = MultiRoleAnalyzer() if use_multi_role else None
         self.use_multi_role = use_multi_role
+        # 多股分析是否走asyncio路径（异步获取实时数据、协程并发调用大模型）
+        self.use_async = use_async
 
-    def analyze_single_stock(self, stock_code: str) -> Dict[str, Any]:
-        """分析单个股票"""
-        print(f"开始分析股票: {stock_code}")
+    def analyze_single_stock(self, stock_code: str) -> StockResult:
+        """分析单个股票，复用批量分析流程，保证两条路径的数据获取和结果格式一致"""
+        log.debug("开始分析股票: %s", stock_code)
+        return self.analyze_multiple_stocks([stock_code], max_workers=1)[0]
 
-        stock_info = self.db.get_stock_info(stock_code)
-        if not stock_info:
-            return {
-                'code': stock_code,
-                'name': '未知',
-                'error': '未找到股票基本信息'
-            }
+    def _build_result(self, code: str, stock_info: Dict[str, Any], real_time_data: Dict[str, Any],
+                      analysis_result: Dict[str, Any], analysis_date: str) -> StockAnalysisResult:
+        """组装单只股票的分析结果"""
+        return StockAnalysisResult(
+            code=code,
+            name=stock_info.get('name', '未知'),
+            analysis_date=analysis_date,
+            current_price=real_time_data.get('current_price', 0),
+            change_percent=real_time_data.get('change_percent', 0),
+            recommendation=analysis_result.get('recommendation', '保持'),
+            reason=analysis_result.get('reason', ''),
+            action=analysis_result.get('action', '保持'),
+            predicted_price=analysis_result.get('predicted_price', 0),
+            predicted_buy_price=analysis_result.get('predicted_buy_price', 0),
+            predicted_sell_price=analysis_result.get('predicted_sell_price', 0),
+            confidence=analysis_result.get('confidence', 0.5)
+        )
 
-        full_code = stock_info.get('full_code')
-        history_data = self.db.get_stock_history(stock_code, days=30)
-        real_time_data = self.stock_fetcher.get_real_time_data(full_code)
-
-        if not real_time_data:
-            return {
-                'code': stock_code,
-                'name': stock_info.get('name', '未知'),
-                'error': '获取实时数据失败'
-            }
-
-        if self.use_multi_role and self.multi_analyzer:
-            analysis_result = self.multi_analyzer.analyze(
-                real_time_data, history_data, stock_info
-            )
-        else:
-            analysis_result = self.llm_service.analyze_stock(
-                real_time_data, history_data, stock_info
-            )
-        print(f"分析结果: {analysis_result}")
-        return {
-            'code': stock_code,
-            'name': stock_info.get('name', '未知'),
-            'analysis_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'current_price': real_time_data.get('current_price', 0),
-            'change_percent': real_time_data.get('change_percent', 0),
-            'recommendation': analysis_result.get('recommendation', '保持'),
-            'reason': analysis_result.get('reason', ''),
-            'action': analysis_result.get('action', '保持'),
-            'predicted_price': analysis_result.get('predicted_price', 0),
-            'predicted_buy_price': analysis_result.get('predicted_buy_price', 0),
-            'predicted_sell_price': analysis_result.get('predicted_sell_price', 0),
-            'confidence': analysis_result.get('confidence', 0.5)
-        }
+    @staticmethod
+    def _full_codes(stock_infos: Dict[str, Dict[str, Any]]) -> List[str]:
+        """准备完整代码列表，过滤掉 full_code 为 None 的情况"""
+        return [info['full_code'] for info in stock_infos.values() if info and info.get('full_code')]
+
+    @staticmethod
+    def _untradable_reason(real_time_data: Dict[str, Any]) -> Optional[str]:
+        """判断股票当前是否可交易：停牌或涨跌停封板（T+1无法做T）都视为不可交易
+
+        Returns:
+            不可交易的原因，可交易时返回None
+        """
+        if real_time_data.get('volume', 0) <= SUSPENDED_MAX_VOLUME:
+            return '停牌'
+        current_price = real_time_data.get('current_price', 0)
+        for limit_price, reason in ((real_time_data.get('limit_up', 0), '涨停封板'),
+                                    (real_time_data.get('limit_down', 0), '跌停封板')):
+            if limit_price > 0 and abs(current_price - limit_price) <= LIMIT_PRICE_TOLERANCE:
+                return reason
+        return None
+
+    def _build_skipped_result(self, code: str, stock_info: Dict[str, Any], real_time_data: Dict[str, Any],
+                              reason: str, analysis_date: str) -> StockAnalysisResult:
+        """组装不可交易股票的结果：未经大模型分析，预测价格取当前价格，信心度为0，避免被当作真实建议"""
+        current_price = real_time_data.get('current_price', 0)
+        return self._build_result(code, stock_info, real_time_data, {
+            'recommendation': SKIPPED_RECOMMENDATION,
+            'reason': f'{reason}，跳过分析',
+            'action': SKIPPED_ACTION,
+            'predicted_price': current_price,
+            'predicted_buy_price': current_price,
+            'predicted_sell_price': current_price,
+            'confidence': 0,
+        }, analysis_date)
+
+    def _prepare_batch(self, stock_codes: List[str], stock_infos: Dict[str, Dict[str, Any]],
+                       real_time_data_dict: Dict[str, Dict[str, Any]],
+                       history_data_dict: Dict[str, List[Dict[str, Any]]],
+                       save_batch_size: Optional[int], output_file: Optional[str]) -> _AnalysisBatch:
+        """按下标整理一批股票，在派发大模型分析前处理不需要分析的股票
+
+        缺少基本信息或实时数据的股票直接记为失败，停牌、涨跌停的股票记为跳过，其余股票的下标放入pending。
+        分析时间以批次为单位，只格式化一次。
+        """
+        code_list = list(stock_codes)
+        batch = _AnalysisBatch(
+            code_list=code_list,
+            info_list=[stock_infos.get(code) for code in code_list],
+            real_time_data_dict=real_time_data_dict,
+            history_data_dict=history_data_dict,
+            analysis_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            save_batch_size=save_batch_size,
+            output_file=output_file,
+            results=[None] * len(code_list),
+        )
+        for i, stock_info in enumerate(batch.info_list):
+            if not stock_info:
+                batch.complete(i, StockAnalysisError(code=code_list[i], name='未知', error='未找到股票基本信息'))
+                continue
+            code, stock_info, real_time_data, _ = batch.inputs(i)
+            if not real_time_data:
+                batch.complete(i, StockAnalysisError(code=code, name=stock_info.get('name', '未知'),
+                                                     error='获取实时数据失败'))
+            elif reason := self._untradable_reason(real_time_data):
+                batch.complete(i, self._build_skipped_result(code, stock_info, real_time_data, reason,
+                                                             batch.analysis_date))
+            else:
+                batch.pending.append(i)
+        return batch
+
+    @staticmethod
+    def _analysis_failed(code: str, e: Exception) -> StockAnalysisError:
+        """记录单只股票的分析异常"""
+        log.warning("分析股票 %s 时出错: %s", code, e)
+        return StockAnalysisError(code=code, name='未知', error=str(e))
+
+    def _analyze_indexed(self, batch: _AnalysisBatch, i: int) -> Tuple[int, StockResult]:
+        """在工作线程中分析批次中的第i只股票，返回 (下标, 结果)"""
+        code, stock_info, real_time_data, history_data = batch.inputs(i)
+        try:
+            if self.use_multi_role and self.multi_analyzer:
+                analysis_result = self.multi_analyzer.analyze(real_time_data, history_data, stock_info)
+            else:
+                analysis_result = self.llm_service.analyze_stock(real_time_data, history_data, stock_info)
+            return i, self._build_result(code, stock_info, real_time_data, analysis_result, batch.analysis_date)
+        except Exception as e:
+            return i, self._analysis_failed(code, e)
+
+    async def _analyze_indexed_async(self, batch: _AnalysisBatch, i: int, semaphore: asyncio.Semaphore,
+                                     executor: ThreadPoolExecutor) -> Tuple[int, StockResult]:
+        """以协程方式分析批次中的第i只股票，返回 (下标, 结果)；单角色分析是同步调用，放到与并发上限同样大小的线程池中执行"""
+        code, stock_info, real_time_data, history_data = batch.inputs(i)
+        try:
+            async with semaphore:
+                if self.use_multi_role and self.multi_analyzer:
+                    analysis_result = await self.multi_analyzer.analyze_async(real_time_data, history_data, stock_info)
+                else:
+                    analysis_result = await asyncio.get_running_loop().run_in_executor(
+                        executor, self.llm_service.analyze_stock, real_time_data, history_data, stock_info
+                    )
+            return i, self._build_result(code, stock_info, real_time_data, analysis_result, batch.analysis_date)
+        except Exception as e:
+            return i, self._analysis_failed(code, e)
+
+    @staticmethod
+    def _progress(batch: _AnalysisBatch) -> tqdm:
+        """分析进度条，不需要分析的股票已计入结果"""
+        return tqdm(total=len(batch.code_list), initial=len(batch.done), desc="股票分析进度", unit="只", ncols=100)
+
+    def _record_result(self, batch: _AnalysisBatch, i: int, result: StockResult):
+        """记录第i只股票的分析结果，未保存的结果达到批次大小时按完成顺序写入文件"""
+        batch.complete(i, result)
+        if batch.save_batch_size and batch.output_file and len(batch.done) - batch.flushed >= batch.save_batch_size:
+            self._flush_results(batch)
+
+    def _flush_results(self, batch: _AnalysisBatch):
+        """将未保存的结果写入文件，第一批覆盖写入，之后追加"""
+        self.save_results_ndjson([batch.results[i] for i in batch.done[batch.flushed:]], batch.output_file,
+                                 append=batch.flushed > 0)
+        batch.flushed = len(batch.done)
+
+    def _finish_batch(self, batch: _AnalysisBatch) -> List[StockResult]:
+        """保存剩余的结果，返回与输入顺序一致的整批结果"""
+        if batch.save_batch_size and batch.output_file:
+            if len(batch.done) > batch.flushed:
+                self._flush_results(batch)
+            if batch.done:
+                log.info("结果已全部保存到: %s", batch.output_file)
+        return batch.results
 
     def analyze_multiple_stocks(self, stock_codes: List[str],
-                                max_workers: int = 20, save_batch_size: int = None,
-                                output_file: str = None) -> List[Dict[str, Any]]:
+                                max_workers: int = None, save_batch_size: int = None,
+                                output_file: str = None) -> List[StockResult]:
         """分析多个股票，支持分批保存结果
         
         Args:
             stock_codes: 股票代码列表
-            max_workers: 并发工作线程数
+            max_workers: 并发工作线程数，默认使用settings.llm_concurrency
             save_batch_size: 每批保存的股票数量，None表示不分批保存
             output_file: 输出文件名，None表示不保存
         
         Returns:
-            分析结果列表
+            与输入顺序一致的分析结果列表
         """
-        from concurrent.futures import ThreadPoolExecutor
-        from tqdm import tqdm
-        
-        results = []
-        temp_results = []
-        
+        if self.use_async:
+            # 与多角色分析共用后台事件循环，重复调用时大模型客户端的异步连接池仍然可用
+            return run_coroutine(self.analyze_multiple_stocks_async(
+                stock_codes, max_concurrency=max_workers, save_batch_size=save_batch_size, output_file=output_file
+            ))
+
         # 1. 批量获取股票基本信息
-        print(f"批量获取 {len(stock_codes)} 只股票的基本信息...")
+        log.info("批量获取 %d 只股票的基本信息...", len(stock_codes))
         stock_infos = self.db.get_batch_stock_info(stock_codes)
+        full_codes = self._full_codes(stock_infos)
         
-        # 2. 准备完整代码列表，过滤掉 full_code 为 None 的情况
-        full_codes = [info['full_code'] for code, info in stock_infos.items() if info and info.get('full_code')]
-        
-        # 3. 批量获取实时数据
-        print(f"批量获取 {len(full_codes)} 只股票的实时数据...")
+        # 2. 批量获取实时数据
+        log.info("批量获取 %d 只股票的实时数据...", len(full_codes))
         real_time_data_dict = self.stock_fetcher.get_multiple_stocks_data(full_codes)
         
-        # 4. 批量获取历史数据
-        print(f"批量获取 {len(full_codes)} 只股票的历史数据...")
+        # 3. 批量获取历史数据
+        log.info("批量获取 %d 只股票的历史数据...", len(full_codes))
         history_data_dict = self.db.get_batch_stock_history(full_codes, days=30)
         
-        # 5. 分析股票
-        def analyze_stock(code):
-            try:
-                stock_info = stock_infos.get(code)
-                if not stock_info:
-                    return {
-                        'code': code,
-                        'name': '未知',
-                        'error': '未找到股票基本信息'
-                    }
-                
-                full_code = stock_info.get('full_code')
-                real_time_data = real_time_data_dict.get(full_code)
-                history_data = history_data_dict.get(full_code, [])
-                
-                if not real_time_data:
-                    return {
-                        'code': code,
-                        'name': stock_info.get('name', '未知'),
-                        'error': '获取实时数据失败'
-                    }
-                
-                if self.use_multi_role and self.multi_analyzer:
-                    analysis_result = self.multi_analyzer.analyze(
-                        real_time_data, history_data, stock_info
-                    )
-                else:
-                    analysis_result = self.llm_service.analyze_stock(
-                        real_time_data, history_data, stock_info
-                    )
-                
-                return {
-                    'code': code,
-                    'name': stock_info.get('name', '未知'),
-                    'analysis_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'current_price': real_time_data.get('current_price', 0),
-                    'change_percent': real_time_data.get('change_percent', 0),
-                    'recommendation': analysis_result.get('recommendation', '保持'),
-                    'reason': analysis_result.get('reason', ''),
-                    'action': analysis_result.get('action', '保持'),
-                    'predicted_price': analysis_result.get('predicted_price', 0),
-                    'predicted_buy_price': analysis_result.get('predicted_buy_price', 0),
-                    'predicted_sell_price': analysis_result.get('predicted_sell_price', 0),
-                    'confidence': analysis_result.get('confidence', 0.5)
-                }
-            except Exception as e:
-                print(f"分析股票 {code} 时出错: {e}")
-                return {
-                    'code': code,
-                    'name': '未知',
-                    'error': str(e)
-                }
-        
-        print(f"开始分析 {len(stock_codes)} 只股票...")
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 使用tqdm包装executor.map的结果，显示分析进度
-            with tqdm(total=len(stock_codes), desc="股票分析进度", unit="只", ncols=100) as pbar:
-                # 使用列表推导式和回调函数更新进度
-                for result in executor.map(analyze_stock, stock_codes):
-                    results.append(result)
-                    temp_results.append(result)
-                    pbar.update(1)  # 更新进度条
-                    
-                    # 当临时结果达到批次大小时，保存结果
-                    if save_batch_size and output_file and len(temp_results) >= save_batch_size:
-                        self.save_results(temp_results, output_file, batch_size=save_batch_size, append=True)
-                        temp_results.clear()
-        
-        # 保存剩余的结果
-        if temp_results and save_batch_size and output_file:
-            self.save_results(temp_results, output_file, batch_size=save_batch_size, append=True)
-            temp_results.clear()
-        
-        # 如果使用了分批保存，需要在文件末尾添加]
-        if save_batch_size and output_file:
-            import os
-            if os.path.exists(output_file):
-                with open(output_file, 'a', encoding='utf-8') as f:
-                    f.write('\n]')
-                print(f"结果已全部保存到: {output_file}")
+        # 4. 在线程池中分析需要调用大模型的股票
+        batch = self._prepare_batch(stock_codes, stock_infos, real_time_data_dict, history_data_dict,
+                                    save_batch_size, output_file)
+        log.info("开始分析 %d 只股票...", len(batch.code_list))
+        with ThreadPoolExecutor(max_workers=max_workers or settings.llm_concurrency) as executor:
+            futures = [executor.submit(self._analyze_indexed, batch, i) for i in batch.pending]
+            with self._progress(batch) as pbar:
+                # 哪只股票先完成就先处理，慢请求不会阻塞进度更新和分批保存
+                for future in as_completed(futures):
+                    self._record_result(batch, *future.result())
+                    pbar.update(1)
+
+        return self._finish_batch(batch)
+
+    @on_event_loop
+    async def analyze_multiple_stocks_async(self, stock_codes: List[str],
+                                            max_concurrency: int = None, save_batch_size: int = None,
+                                            output_file: str = None) -> List[StockResult]:
+        """异步分析多个股票，实时数据通过aiohttp并发获取，大模型调用由信号量限制并发，支持分批保存结果
+
+        Args:
+            stock_codes: 股票代码列表
+            max_concurrency: 同时进行分析的股票数量上限，默认使用settings.llm_concurrency
+            save_batch_size: 每批保存的股票数量，None表示不分批保存
+            output_file: 输出文件名，None表示不保存
+
+        Returns:
+            与输入顺序一致的分析结果列表
+        """
+        # 1. 批量获取股票基本信息（数据库访问是同步的，放到线程中执行）
+        log.info("批量获取 %d 只股票的基本信息...", len(stock_codes))
+        stock_infos = await asyncio.to_thread(self.db.get_batch_stock_info, stock_codes)
+        full_codes = self._full_codes(stock_infos)
+
+        # 2. 并发获取实时数据和历史数据
+        log.info("批量获取 %d 只股票的实时数据和历史数据...", len(full_codes))
+        real_time_data_dict, history_data_dict = await asyncio.gather(
+            get_multiple_stocks_data_async(full_codes),
+            asyncio.to_thread(self.db.get_batch_stock_history, full_codes, 30),
+        )
 
-        return results
+        # 3. 以协程并发分析需要调用大模型的股票，信号量限制同时请求大模型的数量
+        batch = self._prepare_batch(stock_codes, stock_infos, real_time_data_dict, history_data_dict,
+                                    save_batch_size, output_file)
+        concurrency = max_concurrency or settings.llm_concurrency
+        semaphore = asyncio.Semaphore(concurrency)
+        log.info("开始分析 %d 只股票...", len(batch.code_list))
+        # 默认线程池最多min(32, CPU数+4)个线程，会压低信号量设置的并发上限，单角色分析使用单独的线程池
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="llm-analysis") as executor:
+            tasks = [self._analyze_indexed_async(batch, i, semaphore, executor) for i in batch.pending]
+            with self._progress(batch) as pbar:
+                # 哪只股票先完成就先处理，分批保存与剩余的大模型请求重叠进行
+                for future in asyncio.as_completed(tasks):
+                    self._record_result(batch, *await future)
+                    pbar.update(1)
 
-    def get_all_stocks_analysis(self, sample_size: int = None, save_batch_size: int = None, output_file: str = None) -> List[Dict[str, Any]]:
+        return self._finish_batch(batch)
+
+    def get_all_stocks_analysis(self, sample_size: int = None, save_batch_size: int = None, output_file: str = None) -> List[StockResult]:
         """分析所有股票，支持分批保存结果
         
         Args:
@@ -196,81 +357,70 @@ class StockAnalysisSystem:
         all_codes = self.db.get_all_stock_codes()
 
         if sample_size and sample_size < len(all_codes):
-            import random
             all_codes = random.sample(all_codes, sample_size)
 
-        print(f"开始分析 {len(all_codes)} 只股票...")
+        log.info("开始分析 %d 只股票...", len(all_codes))
         return self.analyze_multiple_stocks(all_codes, save_batch_size=save_batch_size, output_file=output_file)
 
-    def save_results(self, results: List[Dict[str, Any]], filename: str, batch_size: int = None, append: bool = False):
+    def save_results(self, results: List[StockResult], filename: str, batch_size: int = None, append: bool = False):
         """保存分析结果，支持分批写入
         
         Args:
             results: 分析结果列表
             filename: 输出文件名
-            batch_size: 每批写入的股票数量，None表示一次写入所有结果
-            append: 是否追加到现有文件
+            batch_size: 不为None时按JSON Lines格式分批写入（见save_results_ndjson），None表示一次写入所有结果
+            append: 分批写入时是否追加到现有文件
         """
         if not results:
             return
         
         # 如果不使用分批写入，直接保存所有结果
         if batch_size is None:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
-            print(f"结果已保存到: {filename}")
+            # orjson直接输出UTF-8字节，中文无需转义
+            with open(filename, 'wb') as f:
+                f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+            log.info("结果已保存到: %s", filename)
             return
         
-        # 使用分批写入
-        import os
-        file_exists = os.path.exists(filename)
-        
-        # 首次写入或覆盖写入时，创建新文件并写入[
-        if not file_exists or not append:
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write('[\n')
-            append = True
-        else:
-            # 如果是追加写入，检查文件是否为空
-            with open(filename, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-            # 如果文件内容为空，写入[
-            if not content:
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write('[\n')
-            # 如果文件内容不为空且不是以[结尾，说明之前有写入，需要添加逗号
-            elif not content.endswith('['):
-                with open(filename, 'a', encoding='utf-8') as f:
-                    f.write(',\n')
+        # 分批写入使用JSON Lines格式
+        self.save_results_ndjson(results, filename, append=append)
+
+    def save_results_ndjson(self, results: List[StockResult], filename: str, append: bool = True):
+        """以JSON Lines格式保存分析结果，每行一个JSON对象
+
+        只追加写入，不需要维护数组的首尾括号，中途中断时已写入的行仍可逐行解析。
+
+        Args:
+            results: 分析结果列表
+            filename: 输出文件名
+            append: 是否追加到现有文件，False时覆盖
+        """
+        if not results:
+            return
         
-        # 分批写入结果
-        for i, result in enumerate(results):
-            with open(filename, 'a', encoding='utf-8') as f:
-                # 写入结果，最后一个结果不需要逗号
-                if i == len(results) - 1:
-                    json.dump(result, f, ensure_ascii=False, indent=2)
-                else:
-                    json.dump(result, f, ensure_ascii=False, indent=2)
-                    f.write(',\n')
+        # 整批预先序列化，只打开一次文件、一次写入
+        payload = b''.join(orjson.dumps(result) + b'\n' for result in results)
+        with open(filename, 'ab' if append else 'wb', buffering=1 << 20) as f:
+            f.write(payload)
         
-        print(f"已保存 {len(results)} 条结果到: {filename}")
+        log.info("已保存 %d 条结果到: %s", len(results), filename)
 
-    def print_results(self, results: List[Dict[str, Any]]):
+    def print_results(self, results: List[StockResult]):
         """打印分析结果"""
         for result in results:
-            if 'error' in result:
-                print(f"股票 {result['code']} 分析失败: {result['error']}")
+            if isinstance(result, StockAnalysisError):
+                print(f"股票 {result.code} 分析失败: {result.error}")
             else:
-                print(f"\n=== {result['name']} ({result['code']}) ===")
-                print(f"当前价格: {result['current_price']}")
-                print(f"涨跌幅: {result['change_percent']}%")
-                print(f"建议: {result['recommendation']}")
-                print(f"动作: {result['action']}")
-                print(f"预测价格(T+1): {result['predicted_price']}")
-                print(f"预测买入价: {result['predicted_buy_price']}")
-                print(f"预测卖出价: {result['predicted_sell_price']}")
-                print(f"信心度: {result['confidence']}")
-                print(f"推荐原因: {result['reason']}")
+                print(f"\n=== {result.name} ({result.code}) ===")
+                print(f"当前价格: {result.current_price}")
+                print(f"涨跌幅: {result.change_percent}%")
+                print(f"建议: {result.recommendation}")
+                print(f"动作: {result.action}")
+                print(f"预测价格(T+1): {result.predicted_price}")
+                print(f"预测买入价: {result.predicted_buy_price}")
+                print(f"预测卖出价: {result.predicted_sell_price}")
+                print(f"信心度: {result.confidence}")
+                print(f"推荐原因: {result.reason}")
 
 
 
@@ -284,11 +434,15 @@ def main():
     parser.add_argument('--output', '-o', type=str, default=f'stock_analysis_result_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json',
                         help='输出结果文件名')
     parser.add_argument('--simple', action='store_true', help='使用简单分析模式')
-    parser.add_argument('--save-batch-size', type=int, default=None, help='分批保存的批次大小，None表示一次写入所有结果')
+    parser.add_argument('--save-batch-size', type=int, default=None, help='分批保存的批次大小（输出为JSON Lines格式，每行一条结果），None表示一次写入所有结果')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='多股分析使用asyncio并发执行')
+    parser.add_argument('--verbose', '-v', action='store_true', help='输出每只股票的调试日志')
 
     args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
-    system = StockAnalysisSystem(use_multi_role=not args.simple)
+    system = StockAnalysisSystem(use_multi_role=not args.simple, use_async=args.use_async)
 
     try:
         if args.stock:
@@ -327,11 +481,11 @@ def main():
                 system.save_results(results, args.output)
 
     except KeyboardInterrupt:
-        print("\n用户中断分析")
+        log.info("用户中断分析")
     except Exception as e:
-        print(f"分析过程中出现错误: {e}")
+        log.error("分析过程中出现错误: %s", e)
     finally:
-        print("分析结束")
+        log.info("分析结束")
 
 
 if __name__ == "__main__":
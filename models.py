@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, BigInteger, SmallInteger, Date, DateTime, Boolean
+from sqlalchemy import Column, String, Float, BigInteger, SmallInteger, Date, DateTime, Boolean, Index
 from sqlalchemy.orm import declarative_base
 
 
@@ -28,6 +28,11 @@ class StockDaily(Base):
     isST = Column(Boolean)
     update_time = Column(DateTime)
 
+    # 主键以date开头，按code查询最近N天历史时用不上；(code, date DESC)使单股历史查询成为一次索引范围扫描
+    __table_args__ = (
+        Index('ix_stock_daily_code_date', code, date.desc()),
+    )
+
 
 class StockInfo(Base):
     __tablename__ = "stock_info"
@@ -44,3 +49,8 @@ class StockInfo(Base):
     full_code = Column(String(20))
     exchange_code = Column(String(20))
 
+    # 历史数据查询通过full_code关联stock_daily.code
+    __table_args__ = (
+        Index('ix_stock_info_full_code', 'full_code'),
+    )
+
@@ -1,200 +1,214 @@
+import logging
+import re
+from operator import itemgetter
+from threading import Lock
+
+import numpy as np
 import requests
-from typing import Dict, Any, Optional
-import time
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Any, List, Optional
+
+log = logging.getLogger(__name__)
+
+BASE_URL = "https://qt.gtimg.cn/q={}"
+# 腾讯行情接口响应格式：v_sh600000="1~名称~代码~..."; 多只股票以分号分隔
+# 直接在响应字节上匹配，数值字段无需解码，只有字符串字段按GBK解码
+_RESPONSE_RE = re.compile(rb'v_(\w+)="([^"]*)"')
+RESPONSE_ENCODING = 'gbk'
+# 每次批量请求的股票数量，避免URL过长
+BATCH_SIZE = 80
+# 请求超时（连接超时, 读取超时），连接阶段失败时尽快重试
+HTTP_TIMEOUT = (3, 10)
+# 连接失败、超时和重试耗尽说明行情服务不可用，此时逐个请求只会重复同样的重试，不再逐个回退
+UNAVAILABLE_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.RetryError)
+
+# 行情字段schema：(字段下标, 键名)，按类型分组，数值字段批量转换
+# 字符串字段
+_STR_FIELDS = (
+    (0, 'unknown'), (1, 'name'), (2, 'code'), (29, 'recent_trades'), (30, 'time'),
+    (35, 'price_volume_amount'), (40, 'unknown_40'),
+)
+# 整数字段（成交量、委托量等）
+_INT_FIELDS = (
+    (6, 'volume'), (7, 'outer_disc'), (8, 'inner_disc'), (10, 'bid_volume_1'),
+    (12, 'bid_volume_2'), (14, 'bid_volume_3'), (16, 'bid_volume_4'), (18, 'bid_volume_5'),
+    (20, 'ask_volume_1'), (22, 'ask_volume_2'), (24, 'ask_volume_3'), (26, 'ask_volume_4'),
+    (28, 'ask_volume_5'), (36, 'volume_hand'),
+)
+# 浮点字段（价格、比率等）
+_FLOAT_FIELDS = (
+    (3, 'current_price'), (4, 'prev_close'), (5, 'open'), (9, 'bid_price_1'), (11, 'bid_price_2'),
+    (13, 'bid_price_3'), (15, 'bid_price_4'), (17, 'bid_price_5'), (19, 'ask_price_1'),
+    (21, 'ask_price_2'), (23, 'ask_price_3'), (25, 'ask_price_4'), (27, 'ask_price_5'),
+    (31, 'change'), (32, 'change_percent'), (33, 'high'), (34, 'low'), (37, 'amount_10k'),
+    (38, 'turnover_rate'), (39, 'pe_ratio'), (41, 'high_2'), (42, 'low_2'), (43, 'amplitude'),
+    (44, 'circulating_market_value'), (45, 'total_market_value'), (46, 'pb_ratio'),
+    (47, 'limit_up'), (48, 'limit_down'),
+)
+_STR_KEYS = tuple(key for _, key in _STR_FIELDS)
+_INT_KEYS = tuple(key for _, key in _INT_FIELDS)
+_FLOAT_KEYS = tuple(key for _, key in _FLOAT_FIELDS)
+_get_strs = itemgetter(*(idx for idx, _ in _STR_FIELDS))
+_get_ints = itemgetter(*(idx for idx, _ in _INT_FIELDS))
+_get_floats = itemgetter(*(idx for idx, _ in _FLOAT_FIELDS))
+
+# 行情约3秒刷新一次，有效期内同一股票的重复请求直接复用缓存，键为full_code
+REALTIME_CACHE_TTL = 3
+REALTIME_CACHE_MAXSIZE = 16384
+realtime_cache = TTLCache(maxsize=REALTIME_CACHE_MAXSIZE, ttl=REALTIME_CACHE_TTL)
+_realtime_cache_lock = Lock()
+
+
+def get_cached_real_time_data(stock_codes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """读取缓存的实时数据，只返回命中且未过期的股票"""
+    with _realtime_cache_lock:
+        return {code: realtime_cache[code] for code in stock_codes if code in realtime_cache}
+
+
+def set_cached_real_time_data(results: Dict[str, Dict[str, Any]]):
+    """写入实时数据缓存，获取失败的股票不在结果中，不会被缓存"""
+    with _realtime_cache_lock:
+        realtime_cache.update(results)
 
 
 class RealTimeStockDataFetcher:
     def __init__(self):
-        self.base_url = "https://qt.gtimg.cn/q={}"
+        self.base_url = BASE_URL
+        # 复用TCP/TLS连接，批量请求之间不再重复握手；连接失败和5xx响应按指数退避重试
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @staticmethod
+    def _parse_values(values: List[bytes]) -> Dict[str, Any]:
+        """将按~分隔的行情字段解析为字典"""
+        return RealTimeStockDataFetcher._parse_rows([values])[0]
+
+    @staticmethod
+    def _parse_rows(rows: List[List[bytes]]) -> List[Dict[str, Any]]:
+        """批量解析多条行情记录：数值字段堆叠成矩阵后一次性转换类型，空字段按0处理"""
+        ints = np.array([_get_ints(values) for values in rows], dtype=bytes)
+        ints[ints == b''] = b'0'
+        floats = np.array([_get_floats(values) for values in rows], dtype=bytes)
+        floats[floats == b''] = b'0'
+        int_rows = ints.astype(np.int64).tolist()
+        float_rows = floats.astype(np.float64).tolist()
+
+        results = []
+        for values, int_values, float_values in zip(rows, int_rows, float_rows):
+            result = {key: value.decode(RESPONSE_ENCODING, errors='replace')
+                      for key, value in zip(_STR_KEYS, _get_strs(values))}
+            result.update(zip(_INT_KEYS, int_values))
+            result.update(zip(_FLOAT_KEYS, float_values))
+            results.append(result)
+        return results
 
     def get_real_time_data(self, stock_code: str) -> Optional[Dict[str, Any]]:
-        """获取股票实时数据"""
+        """获取股票实时数据，优先使用缓存"""
+        cached_data = get_cached_real_time_data([stock_code])
+        if cached_data:
+            return cached_data[stock_code]
+
+        data = self._fetch_real_time_data(stock_code)
+        if data:
+            set_cached_real_time_data({stock_code: data})
+        return data
+
+    def _fetch_real_time_data(self, stock_code: str) -> Optional[Dict[str, Any]]:
+        """请求并解析单只股票的实时数据"""
         url = self.base_url.format(stock_code)
 
         try:
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=HTTP_TIMEOUT)
             response.raise_for_status()
 
-            data = response.text.strip()
-            if not data:
-                return None
-
-            data_parts = data.split('=')
-            if len(data_parts) < 2:
+            match = _RESPONSE_RE.search(response.content)
+            if not match:
                 return None
 
-            values = data_parts[1].strip('"').split('~')
-
+            values = match.group(2).split(b'~')
             if len(values) < 49:
                 return None
 
-            return {
-                'unknown': values[0],
-                'name': values[1],
-                'code': values[2],
-                'current_price': float(values[3]) if values[3] else 0.0,
-                'prev_close': float(values[4]) if values[4] else 0.0,
-                'open': float(values[5]) if values[5] else 0.0,
-                'volume': int(values[6]) if values[6] else 0,
-                'outer_disc': int(values[7]) if values[7] else 0,
-                'inner_disc': int(values[8]) if values[8] else 0,
-                'bid_price_1': float(values[9]) if values[9] else 0.0,
-                'bid_volume_1': int(values[10]) if values[10] else 0,
-                'bid_price_2': float(values[11]) if values[11] else 0.0,
-                'bid_volume_2': int(values[12]) if values[12] else 0,
-                'bid_price_3': float(values[13]) if values[13] else 0.0,
-                'bid_volume_3': int(values[14]) if values[14] else 0,
-                'bid_price_4': float(values[15]) if values[15] else 0.0,
-                'bid_volume_4': int(values[16]) if values[16] else 0,
-                'bid_price_5': float(values[17]) if values[17] else 0.0,
-                'bid_volume_5': int(values[18]) if values[18] else 0,
-                'ask_price_1': float(values[19]) if values[19] else 0.0,
-                'ask_volume_1': int(values[20]) if values[20] else 0,
-                'ask_price_2': float(values[21]) if values[21] else 0.0,
-                'ask_volume_2': int(values[22]) if values[22] else 0,
-                'ask_price_3': float(values[23]) if values[23] else 0.0,
-                'ask_volume_3': int(values[24]) if values[24] else 0,
-                'ask_price_4': float(values[25]) if values[25] else 0.0,
-                'ask_volume_4': int(values[26]) if values[26] else 0,
-                'ask_price_5': float(values[27]) if values[27] else 0.0,
-                'ask_volume_5': int(values[28]) if values[28] else 0,
-                'recent_trades': values[29],
-                'time': values[30],
-                'change': float(values[31]) if values[31] else 0.0,
-                'change_percent': float(values[32]) if values[32] else 0.0,
-                'high': float(values[33]) if values[33] else 0.0,
-                'low': float(values[34]) if values[34] else 0.0,
-                'price_volume_amount': values[35],
-                'volume_hand': int(values[36]) if values[36] else 0,
-                'amount_10k': float(values[37]) if values[37] else 0.0,
-                'turnover_rate': float(values[38]) if values[38] else 0.0,
-                'pe_ratio': float(values[39]) if values[39] else 0.0,
-                'unknown_40': values[40],
-                'high_2': float(values[41]) if values[41] else 0.0,
-                'low_2': float(values[42]) if values[42] else 0.0,
-                'amplitude': float(values[43]) if values[43] else 0.0,
-                'circulating_market_value': float(values[44]) if values[44] else 0.0,
-                'total_market_value': float(values[45]) if values[45] else 0.0,
-                'pb_ratio': float(values[46]) if values[46] else 0.0,
-                'limit_up': float(values[47]) if values[47] else 0.0,
-                'limit_down': float(values[48]) if values[48] else 0.0
-            }
+            return self._parse_values(values)
 
         except requests.RequestException as e:
-            print(f"请求股票实时数据错误: {e}")
+            log.error("请求股票实时数据错误: %s", e)
             return None
         except (ValueError, IndexError) as e:
-            print(f"解析股票数据错误: {e}")
+            log.error("解析股票数据错误: %s", e)
             return None
 
-    def get_multiple_stocks_data(self, stock_codes: list, delay: float = 0.1) -> Dict[str, Dict[str, Any]]:
-        """批量获取多个股票实时数据"""
+    @classmethod
+    def parse_batch_response(cls, content: bytes, batch_codes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """解析批量行情响应的原始字节，以请求时的full_code作为键"""
+        keys = []
+        rows = []
+        requested = set(batch_codes)
+        for response_key, payload in _RESPONSE_RE.findall(content):
+            values = payload.split(b'~')
+            if len(values) < 49:
+                continue
+
+            # 响应中的变量名一般就是请求的代码；否则按响应中的股票代码匹配请求的 full_code，确保后续能正确匹配
+            response_key = response_key.decode('ascii')
+            if response_key in requested:
+                key = response_key
+            else:
+                response_code = values[2].decode('ascii', errors='replace')
+                key = next((full_code for full_code in batch_codes if response_code in full_code), response_code)
+            keys.append(key)
+            rows.append(values)
+
+        if not rows:
+            return {}
+        try:
+            return dict(zip(keys, cls._parse_rows(rows)))
+        except ValueError:
+            # 有记录无法转换时逐条解析，只跳过出错的记录
+            results = {}
+            for key, values in zip(keys, rows):
+                try:
+                    results[key] = cls._parse_values(values)
+                except (ValueError, IndexError) as e:
+                    log.warning("解析股票 %s 数据错误: %s", key, e)
+            return results
+
+    def get_multiple_stocks_data(self, stock_codes: list) -> Dict[str, Dict[str, Any]]:
+        """批量获取多个股票实时数据，缓存中已有的股票不再请求"""
         results = {}
         
         # 批量获取多个股票数据，使用逗号分隔股票代码
         if not stock_codes:
             return results
+
+        cached_data = get_cached_real_time_data(stock_codes)
+        missing_codes = [code for code in stock_codes if code not in cached_data]
+        log.debug("实时数据缓存命中 %d/%d", len(cached_data), len(stock_codes))
         
-        # 分组处理，每组最多100个股票代码，避免URL过长
-        batch_size = 100
-        for i in range(0, len(stock_codes), batch_size):
-            batch_codes = stock_codes[i:i+batch_size]
+        # 分组处理，每组最多BATCH_SIZE个股票代码，避免URL过长
+        for i in range(0, len(missing_codes), BATCH_SIZE):
+            batch_codes = missing_codes[i:i+BATCH_SIZE]
             url = self.base_url.format(",".join(batch_codes))
             
             try:
-                response = requests.get(url, timeout=10)
+                response = self.session.get(url, timeout=HTTP_TIMEOUT)
                 response.raise_for_status()
-                
-                data = response.text.strip()
-                if not data:
-                    continue
-                
-                # 处理多个股票数据，每个股票数据以";"分隔
-                stock_data_list = data.split(";")
-                for stock_data in stock_data_list:
-                    if not stock_data or "=" not in stock_data:
-                        continue
-                    
-                    data_parts = stock_data.split('=')
-                    if len(data_parts) < 2:
-                        continue
-                    
-                    values = data_parts[1].strip('"').split('~')
-                    if len(values) < 49:
-                        continue
-                    
-                    # 直接使用请求的 full_code 作为键，确保后续能正确匹配
-                    # 从请求的 batch_codes 中找到对应的 full_code
-                    response_code = values[2]  # 响应中的股票代码
-                    matched_full_code = None
-                    for full_code in batch_codes:
-                        # 检查 full_code 是否以响应代码结尾，或者包含响应代码
-                        if response_code in full_code:
-                            matched_full_code = full_code
-                            break
-                    
-                    # 如果找到了匹配的 full_code，就用它作为键，否则使用响应中的代码
-                    key = matched_full_code if matched_full_code else response_code
-                    results[key] = {
-                        'unknown': values[0],
-                        'name': values[1],
-                        'code': values[2],
-                        'current_price': float(values[3]) if values[3] else 0.0,
-                        'prev_close': float(values[4]) if values[4] else 0.0,
-                        'open': float(values[5]) if values[5] else 0.0,
-                        'volume': int(values[6]) if values[6] else 0,
-                        'outer_disc': int(values[7]) if values[7] else 0,
-                        'inner_disc': int(values[8]) if values[8] else 0,
-                        'bid_price_1': float(values[9]) if values[9] else 0.0,
-                        'bid_volume_1': int(values[10]) if values[10] else 0,
-                        'bid_price_2': float(values[11]) if values[11] else 0.0,
-                        'bid_volume_2': int(values[12]) if values[12] else 0,
-                        'bid_price_3': float(values[13]) if values[13] else 0.0,
-                        'bid_volume_3': int(values[14]) if values[14] else 0,
-                        'bid_price_4': float(values[15]) if values[15] else 0.0,
-                        'bid_volume_4': int(values[16]) if values[16] else 0,
-                        'bid_price_5': float(values[17]) if values[17] else 0.0,
-                        'bid_volume_5': int(values[18]) if values[18] else 0,
-                        'ask_price_1': float(values[19]) if values[19] else 0.0,
-                        'ask_volume_1': int(values[20]) if values[20] else 0,
-                        'ask_price_2': float(values[21]) if values[21] else 0.0,
-                        'ask_volume_2': int(values[22]) if values[22] else 0,
-                        'ask_price_3': float(values[23]) if values[23] else 0.0,
-                        'ask_volume_3': int(values[24]) if values[24] else 0,
-                        'ask_price_4': float(values[25]) if values[25] else 0.0,
-                        'ask_volume_4': int(values[26]) if values[26] else 0,
-                        'ask_price_5': float(values[27]) if values[27] else 0.0,
-                        'ask_volume_5': int(values[28]) if values[28] else 0,
-                        'recent_trades': values[29],
-                        'time': values[30],
-                        'change': float(values[31]) if values[31] else 0.0,
-                        'change_percent': float(values[32]) if values[32] else 0.0,
-                        'high': float(values[33]) if values[33] else 0.0,
-                        'low': float(values[34]) if values[34] else 0.0,
-                        'price_volume_amount': values[35],
-                        'volume_hand': int(values[36]) if values[36] else 0,
-                        'amount_10k': float(values[37]) if values[37] else 0.0,
-                        'turnover_rate': float(values[38]) if values[38] else 0.0,
-                        'pe_ratio': float(values[39]) if values[39] else 0.0,
-                        'unknown_40': values[40],
-                        'high_2': float(values[41]) if values[41] else 0.0,
-                        'low_2': float(values[42]) if values[42] else 0.0,
-                        'amplitude': float(values[43]) if values[43] else 0.0,
-                        'circulating_market_value': float(values[44]) if values[44] else 0.0,
-                        'total_market_value': float(values[45]) if values[45] else 0.0,
-                        'pb_ratio': float(values[46]) if values[46] else 0.0,
-                        'limit_up': float(values[47]) if values[47] else 0.0,
-                        'limit_down': float(values[48]) if values[48] else 0.0
-                    }
+                results.update(self.parse_batch_response(response.content, batch_codes))
+            except UNAVAILABLE_ERRORS as e:
+                log.error("批量请求股票实时数据错误，行情服务不可用: %s", e)
             except requests.RequestException as e:
-                print(f"批量请求股票实时数据错误: {e}")
-                # 单个请求失败后，尝试逐个请求
+                log.error("批量请求股票实时数据错误: %s", e)
+                # 批量响应异常或不完整时，尝试逐个请求
                 for code in batch_codes:
-                    data = self.get_real_time_data(code)
+                    data = self._fetch_real_time_data(code)
                     if data:
                         results[code] = data
-                    time.sleep(delay)
-            except (ValueError, IndexError) as e:
-                print(f"批量解析股票数据错误: {e}")
-        
-        return results
\ No newline at end of file
+
+        set_cached_real_time_data(results)
+        results.update(cached_data)
+        return results
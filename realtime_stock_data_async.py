@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from typing import Dict, Any, List
+
+import aiohttp
+
+from realtime_stock_data import (
+    BASE_URL, BATCH_SIZE, RealTimeStockDataFetcher, get_cached_real_time_data, set_cached_real_time_data,
+)
+
+log = logging.getLogger(__name__)
+
+# 同时保持的最大连接数
+MAX_CONNECTIONS = 100
+
+
+def _service_unavailable(e: Exception) -> bool:
+    """连接失败、超时和5xx响应说明行情服务不可用，逐个请求只会得到同样的错误，与同步版本的UNAVAILABLE_ERRORS对应"""
+    if isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return True
+    return isinstance(e, aiohttp.ClientResponseError) and e.status >= 500
+
+
+async def fetch(session: aiohttp.ClientSession, batch_codes: List[str],
+                fallback: bool = True) -> Dict[str, Dict[str, Any]]:
+    """异步获取一批股票的实时数据
+
+    Args:
+        session: 共享的aiohttp会话
+        batch_codes: 本批股票的full_code列表
+        fallback: 批量响应异常或不完整时是否逐个并发请求，行情服务不可用（连接失败、超时、5xx）时不回退，与同步版本的行为一致
+    """
+    url = BASE_URL.format(",".join(batch_codes))
+    try:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            content = await response.read()
+        return RealTimeStockDataFetcher.parse_batch_response(content, batch_codes)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        if _service_unavailable(e):
+            log.error("批量请求股票实时数据错误，行情服务不可用: %s", e)
+            return {}
+        log.error("批量请求股票实时数据错误: %s", e)
+        if not fallback or len(batch_codes) == 1:
+            return {}
+
+    # 批量响应异常或不完整时，尝试逐个请求
+    results = {}
+    for result in await asyncio.gather(*(fetch(session, [code], fallback=False) for code in batch_codes)):
+        results.update(result)
+    return results
+
+
+async def get_multiple_stocks_data_async(stock_codes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """异步批量获取多个股票实时数据，所有批次在一个事件循环中并发请求，缓存中已有的股票不再请求"""
+    if not stock_codes:
+        return {}
+
+    cached_data = get_cached_real_time_data(stock_codes)
+    missing_codes = [code for code in stock_codes if code not in cached_data]
+    log.debug("实时数据缓存命中 %d/%d", len(cached_data), len(stock_codes))
+    if not missing_codes:
+        return cached_data
+
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=10, sock_connect=3)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        batches = [missing_codes[i:i + BATCH_SIZE] for i in range(0, len(missing_codes), BATCH_SIZE)]
+        batch_results = await asyncio.gather(*(fetch(session, batch) for batch in batches))
+
+    results = {}
+    for batch_result in batch_results:
+        results.update(batch_result)
+    set_cached_real_time_data(results)
+    results.update(cached_data)
+    return results
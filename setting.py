@@ -6,10 +6,26 @@ class Settings(BaseSettings):
     db_name: str = "stock"
     db_user: str = "root"
     db_password: str = ""
+    db_pool_size: int = 32
+    db_max_overflow: int = 64
+    db_pool_recycle: int = 1800
 
     llm_base_url: str = "http://172.16.3.64:49090/v1"
     llm_model: str = "Qwen3-235B-A22B-Instruct-2507"
     llm_api_key: str = "test_qwen"
+    # 是否使用结构化输出（JSON Schema），后端不支持时关闭，改为从文本中解析JSON
+    llm_structured_output: bool = True
+    # 同时向大模型后端发起的分析数量上限；后端使用FP8量化和连续批处理时可承载约64的并发批量
+    llm_concurrency: int = 64
+    # 多角色分析合并为一次大模型请求：各角色的分析和最终决策在同一个结构化结果中返回
+    multi_role_fused: bool = False
+
+    # 语义缓存：同一股票提示词向量相似度超过阈值时复用结果，默认关闭
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = 0.95
+    # 语义缓存条目有效期（秒），默认与精确缓存一样为1天，过期后不再命中
+    semantic_cache_ttl: int = 24 * 60 * 60
+    embedding_model: str = "bge-m3"
     class Config:
         env_file = ".env"
 